@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Customer, Category, Product, Invoice, InvoiceItem, Company, CompanyProfile, OTPVerification, Return, ReturnItem, Payment, CustomerBalance
+from .models import User, Customer, Category, Product, Invoice, InvoiceItem, Company, CompanyProfile, OTPVerification, Return, ReturnItem, Payment, CustomerBalance, CustomerLedgerEntry
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -172,4 +172,22 @@ class CustomerBalanceAdmin(admin.ModelAdmin):
         ('الحسابات', {
             'fields': ('total_invoiced', 'total_paid', 'total_returns', 'balance', 'last_updated')
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(CustomerLedgerEntry)
+class CustomerLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'entry_type', 'reference', 'amount', 'balance', 'created_at')
+    list_filter = ('company', 'entry_type', 'created_at')
+    search_fields = ('customer__name', 'reference')
+    ordering = ('-created_at', '-id')
+    # No bulk delete action; delete permission itself stays, since deleting a
+    # customer or company must be able to cascade to its entries
+    actions = None
+
+    # Append-only: entries are written by the balance engine, never edited
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -220,6 +220,13 @@ def admin_add_product_by_phone(request):
     if not phone or not name or price is None or stock_qty is None:
         return Response({"error": "missing_required_fields"}, status=400)
 
+    try:
+        stock_qty = int(stock_qty)
+    except (TypeError, ValueError):
+        return Response({"error": "invalid_stock_qty"}, status=400)
+    if stock_qty < 0:
+        return Response({"error": "invalid_stock_qty"}, status=400)
+
     clean_phone = phone.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
     print(f"[DEBUG] Clean phone: {clean_phone}")
 
@@ -253,7 +260,7 @@ def admin_add_product_by_phone(request):
         "company": company,
         "name": name,
         "price": float(price),
-        "stock_qty": int(stock_qty),
+        "stock_qty": stock_qty,
         "category": category  # Category is required
     }
 
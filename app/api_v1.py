@@ -1,54 +1,82 @@
-from rest_framework import viewsets, status, mixins
+from rest_framework import viewsets, status, mixins, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.pagination import CursorPagination
 from django.db import transaction
-from django.db.models import Sum, Q, F, Case, When, DecimalField
+from django.http import HttpResponse
+from django.db.models import Sum, Q, F, Case, When, Count, DecimalField
 import random
 import requests
 
 from .models import (
     Company, CompanyProfile, User, Category, Product, Customer,
-    Invoice, InvoiceItem, Return, ReturnItem, Payment,
-    CustomerBalance, OTPVerification, company_queryset
+    Invoice, InvoiceItem, Return, Payment,
+    CustomerBalance, CustomerLedgerEntry, ReceivableAging, OTPVerification, company_queryset
 )
 from .serializers import (
     CompanySerializer, CompanyProfileSerializer, UserSerializer, CategorySerializer, ProductSerializer,
-    CustomerSerializer, InvoiceSerializer, InvoiceItemSerializer,
+    CustomerSerializer, InvoiceSerializer, InvoiceListSerializer, InvoiceItemSerializer,
     ReturnSerializer, ReturnItemSerializer, PaymentSerializer,
-    CustomerBalanceSerializer
+    CustomerBalanceSerializer, CustomerLedgerEntrySerializer
 )
 from .permissions import IsCompanyOwner, IsCompanyStaff, ReadOnlyOrOwner
+from .balances import AGING_BUCKETS, balances_before, period_start, post_entries, post_entry, refresh_company_aging
+from .invoicing import add_lines, cancel_invoice, confirm_invoice, confirm_invoices, invoice_entry, parse_lines
+from .stock import InsufficientStock
+from .returns import (
+    ReturnExceedsSold, approve_returns, create_return, parse_return_lines, record_returned_quantities, returned_quantities
+)
+from .idempotency import idempotent
+from .carts import add_to_cart, clear_cart, get_cart, set_cart
+from .exports import EXPORT_FORMATS, export_response
+from .imports import ImportFormatError, import_products
+from .labels import MAX_LABELS_PER_SHEET, QR_BATCH_SIZE, generate_qr_codes, render_label_sheet
+from .lookup import LOOKUP_FIELDS, lookup_product
+from .search import search_products, suggest_products
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
+
+
+class ExportMixin:
+    """``GET <list>/export/?export_format=csv|ndjson``: the filtered list streamed as plain rows"""
+    # values() names; export_annotations defines the aliased (related) ones
+    export_fields = ()
+    export_annotations = {}
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # Not ?format=, which DRF uses to pick a renderer
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'detail': 'invalid_export_format'}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset()).annotate(**self.export_annotations).order_by('pk')
+        return export_response(queryset, self.export_fields, self.basename.removeprefix('v1-'), export_format)
+
+
+class BulkActionMixin:
+    """Parsing and visibility checks shared by the ``{"ids": [...]}`` bulk actions"""
+
+    def bulk_ids(self, request, name):
+        """Unique ids of the request body in the order given; raises ValueError on malformed input"""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            raise ValueError('ids must be a non-empty list')
+        try:
+            return list(dict.fromkeys(int(pk) for pk in ids))
+        except (TypeError, ValueError):
+            raise ValueError(f'invalid {name} id')
 
-
-def update_customer_balance(customer, company):
-    """Update customer balance (moved from legacy api.py)"""
-    try:
-        balance, created = CustomerBalance.objects.get_or_create(
-            customer=customer,
-            company=company,
-            defaults={
-                'total_invoiced': 0,
-                'total_paid': 0,
-                'total_returns': 0,
-                'balance': 0
-            }
-        )
-
-        total_invoiced = sum(inv.total_amount for inv in customer.invoices.filter(company=company, status='confirmed'))
-        total_paid = sum(pay.amount for pay in Payment.objects.filter(customer=customer, company=company))
-        total_returns = sum(ret.total_amount for ret in Return.objects.filter(customer=customer, company=company, status='approved'))
-
-        balance.total_invoiced = total_invoiced
-        balance.total_paid = total_paid
-        balance.total_returns = total_returns
-        balance.calculate_balance()
-    except Exception as e:
-        print(f"Error updating customer balance: {e}")
+    def run_bulk(self, ids, run):
+        """``run`` the ids visible to the user; returns ``(done, [(id, failure), ...])`` in request order"""
+        found = set(self.get_queryset().filter(pk__in=ids).values_list('pk', flat=True))
+        done, failures = run([pk for pk in ids if pk in found])
+        failures.update({pk: {'code': 'not_found'} for pk in ids if pk not in found})
+        return done, [(pk, failures[pk]) for pk in ids if pk in failures]
 
 
 class CompanyScopedQuerysetMixin:
@@ -69,6 +97,14 @@ class CompanyScopedQuerysetMixin:
         serializer.save(company=company)
 
 
+class StatementPagination(CursorPagination):
+    """Keyset pagination over the customer ledger index (customer, created_at, id)"""
+    ordering = ('created_at', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
 class CompanyProfileViewSet(mixins.RetrieveModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
     serializer_class = CompanyProfileSerializer
     queryset = CompanyProfile.objects.select_related('company')
@@ -117,13 +153,91 @@ class CategoryViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
     ordering_fields = ['name', 'id']
 
 
-class ProductViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
+class ProductViewSet(ExportMixin, BulkActionMixin, CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.select_related('category')
     permission_classes = [ReadOnlyOrOwner]
     filterset_fields = ['category', 'archived']
-    search_fields = ['name', 'sku', 'description']
     ordering_fields = ['name', 'price', 'stock_qty', 'created_at']
+    export_fields = (
+        'id', 'sku', 'barcode', 'name', 'category_name', 'price', 'stock_qty', 'unit', 'measurement', 'description',
+        'cost_price', 'wholesale_price', 'retail_price', 'archived', 'created_at',
+    )
+    export_annotations = {'category_name': F('category__name')}
+
+    def get_queryset(self):
+        qs = super().get_queryset().select_related('category')
+        search = (self.request.query_params.get('search') or '').strip()
+        if search and self.action in ('list', 'export'):
+            # Ranked full-text search over the normalized name/SKU/description
+            qs = search_products(qs, search, getattr(self.request.user, 'company_id', None))
+        return qs
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Search-as-you-type: the best few matches for ``?q=``, minimal payload, no pagination"""
+        products = suggest_products(
+            company_queryset(Product, request.user), request.query_params.get('q') or '', request.user.company_id
+        )
+        return Response([
+            {**row, 'price': str(row['price'])} for row in products.values(*LOOKUP_FIELDS, 'stock_qty')
+        ])
+
+    @action(detail=False, methods=['get'])
+    def lookup(self, request):
+        """Exact SKU/barcode match for scanners: ``?code=``, minimal payload, no pagination"""
+        code = (request.query_params.get('code') or '').strip()
+        if not code:
+            return Response({'detail': 'code_required'}, status=status.HTTP_400_BAD_REQUEST)
+        product = lookup_product(request.user.company_id, code)
+        if product is None:
+            return Response({'detail': 'product_not_found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(product)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsCompanyOwner],
+            parser_classes=[MultiPartParser, FormParser])
+    def import_products(self, request):
+        """Bulk create products from an uploaded CSV/XLSX sheet (``file``); bad rows are reported, not fatal"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'file_required'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or ('xlsx' if upload.name.lower().endswith('.xlsx') else 'csv')
+        if file_format not in ('csv', 'xlsx'):
+            return Response({'detail': 'invalid_file_format'}, status=status.HTTP_400_BAD_REQUEST)
+        create_categories, dry_run = (
+            str(request.data.get(name, '')).lower() in ['1', 'true', 'on', 'yes'] for name in ('create_categories', 'dry_run')
+        )
+        try:
+            report = import_products(
+                request.user.company, upload, file_format, create_categories=create_categories, dry_run=dry_run,
+            )
+        except ImportFormatError as exc:
+            return Response({'detail': exc.code, **exc.extra}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_200_OK if report['dry_run'] else status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsCompanyOwner])
+    def generate_qr(self, request):
+        """Fill missing QR images, at most one batch per request; the generate_qr_codes command handles whole catalogs"""
+        products = company_queryset(Product, request.user)
+        generated = generate_qr_codes(products, limit=QR_BATCH_SIZE)
+        return Response({'generated': generated, 'remaining': products.filter(qr_code='').exclude(sku__isnull=True).count()})
+
+    @action(detail=False, methods=['post'])
+    def labels(self, request):
+        """Printable label sheet (PDF) for {"ids": [...]}, in the order given"""
+        try:
+            ids = self.bulk_ids(request, 'product')
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        if len(ids) > MAX_LABELS_PER_SHEET:
+            return Response({'detail': 'too_many_products', 'max': MAX_LABELS_PER_SHEET}, status=400)
+        products = company_queryset(Product, request.user).only('name', 'sku', 'price').in_bulk(ids)
+        currency = CompanyProfile.objects.filter(company_id=request.user.company_id).values_list('primary_currency', flat=True).first()
+        response = HttpResponse(
+            render_label_sheet([products[pk] for pk in ids if pk in products], currency or ''), content_type='application/pdf'
+        )
+        response['Content-Disposition'] = 'attachment; filename="labels.pdf"'
+        return response
 
     @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
     def archive(self, request, pk=None):
@@ -140,13 +254,14 @@ class ProductViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
         return Response({'success': True, 'archived': False})
 
 
-class CustomerViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
+class CustomerViewSet(ExportMixin, CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
     queryset = Customer.objects.all()
     permission_classes = [ReadOnlyOrOwner]
     filterset_fields = ['archived']
     search_fields = ['name', 'phone', 'email']
     ordering_fields = ['name', 'created_at']
+    export_fields = ('id', 'name', 'phone', 'email', 'address', 'archived', 'created_at')
 
     @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
     def archive(self, request, pk=None):
@@ -162,16 +277,33 @@ class CustomerViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
         customer.save(update_fields=['archived'])
         return Response({'success': True, 'archived': False})
 
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        customer = self.get_object()
+        paginator = StatementPagination()
+        # No view passed: the statement order must not follow the list's ?ordering=
+        page = paginator.paginate_queryset(CustomerLedgerEntry.objects.filter(customer=customer), request)
+        return paginator.get_paginated_response(CustomerLedgerEntrySerializer(page, many=True).data)
+
 
-class InvoiceViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
+class InvoiceViewSet(ExportMixin, BulkActionMixin, CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = InvoiceSerializer
     queryset = Invoice.objects.select_related('customer')
     permission_classes = [IsCompanyStaff]
     filterset_fields = ['status', 'customer']
     ordering_fields = ['created_at', 'total_amount']
+    export_fields = ('id', 'customer_id', 'customer_name', 'status', 'created_at', 'total_amount')
+    export_annotations = {'customer_name': F('customer__name')}
 
     def get_queryset(self):
-        qs = super().get_queryset().select_related('customer')
+        qs = super().get_queryset()
+        if self.action == 'list':
+            # Explicit order_by: Meta.ordering does not apply to GROUP BY querysets
+            qs = qs.annotate(customer_name=F('customer__name'), items_count=Count('items')).order_by('-created_at')
+        elif self.action == 'retrieve':
+            qs = qs.select_related('customer', 'company').prefetch_related('items__product')
+        else:
+            qs = qs.select_related('customer')
         search = (self.request.query_params.get('search') or '').strip()
         if search:
             try:
@@ -184,34 +316,122 @@ class InvoiceViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
             qs = qs.filter(q)
         return qs
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return InvoiceListSerializer
+        return super().get_serializer_class()
+
+    def _detail_response(self, invoice):
+        invoice = Invoice.objects.select_related('customer', 'company').prefetch_related('items__product').get(pk=invoice.pk)
+        return Response(InvoiceSerializer(invoice).data)
+
     def perform_create(self, serializer):
         # Only owners can create invoices
         if not IsCompanyOwner().has_permission(self.request, self):
             raise PermissionDenied('Only company owners can create invoices')
         super().perform_create(serializer)
 
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_customer = serializer.instance.customer
+        invoice = serializer.save()
+        if invoice.status == Invoice.CONFIRMED and invoice.customer_id != previous_customer.id:
+            post_entry(previous_customer, invoice.company, CustomerLedgerEntry.ADJUSTMENT, invoice.id, 'invoice_customer_changed', invoiced=-invoice.total_amount)
+            post_entry(invoice.customer, invoice.company, CustomerLedgerEntry.INVOICE, invoice.id, invoiced=invoice.total_amount)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance_id = instance.pk
+        if instance.status == Invoice.CONFIRMED:
+            # Approved returns of the invoice are deleted with it (cascade)
+            returned = instance.returns.filter(status='approved').aggregate(total=Sum('total_amount'))['total'] or 0
+            instance.delete()
+            post_entry(instance.customer, instance.company, CustomerLedgerEntry.ADJUSTMENT, instance_id, 'invoice_deleted', invoiced=-instance.total_amount, returns=-returned)
+        else:
+            instance.delete()
+        transaction.on_commit(lambda: clear_cart(instance_id))
+
     @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
+    @idempotent
+    @transaction.atomic
     def add_item(self, request, pk=None):
+        invoice = self.get_object()
+        if invoice.status != Invoice.DRAFT:
+            return Response({'detail': 'Invoice not in draft state'}, status=400)
+        product_id = request.data.get('product') or request.data.get('product_id')
+        if not product_id:
+            return Response({'detail': 'product is required'}, status=400)
         try:
-            invoice = self.get_object()
-            if invoice.status != Invoice.DRAFT:
-                return Response({'detail': 'Invoice not in draft state'}, status=400)
-            product_id = request.data.get('product') or request.data.get('product_id')
-            qty = float(request.data.get('qty', 1))
-            if not product_id:
-                return Response({'detail': 'product is required'}, status=400)
-            product = company_queryset(Product, request.user).get(id=product_id)
-            existing_qty = sum(float(item.qty) for item in invoice.items.filter(product=product))
-            total_required = existing_qty + qty
-            if product.stock_qty < total_required:
-                can_add = max(0, product.stock_qty - existing_qty)
-                return Response({'code': 'insufficient_stock', 'available': product.stock_qty, 'already_in_invoice': existing_qty, 'can_add': can_add}, status=400)
-            InvoiceItem.objects.create(invoice=invoice, product=product, qty=qty, price_at_add=product.price)
-            invoice.total_amount = sum(i.line_total for i in invoice.items.all())
-            invoice.save(update_fields=['total_amount'])
-            return Response(InvoiceSerializer(invoice).data)
+            add_lines(invoice, parse_lines([{'product': product_id, 'qty': request.data.get('qty', 1)}]))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        except Product.DoesNotExist:
+            return Response({'detail': 'product_not_found'}, status=404)
+        except InsufficientStock as e:
+            shortage = e.products[0]
+            return Response({'code': 'insufficient_stock', 'available': shortage['available'], 'already_in_invoice': shortage['already_in_invoice'], 'can_add': shortage['can_add']}, status=400)
+        return self._detail_response(invoice)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
+    @idempotent
+    @transaction.atomic
+    def add_items(self, request, pk=None):
+        """Add many lines at once: {"items": [{"product": id, "qty": n}, ...]}"""
+        invoice = self.get_object()
+        if invoice.status != Invoice.DRAFT:
+            return Response({'detail': 'Invoice not in draft state'}, status=400)
+        try:
+            add_lines(invoice, parse_lines(request.data.get('items')))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
         except Product.DoesNotExist:
             return Response({'detail': 'product_not_found'}, status=404)
+        except InsufficientStock as e:
+            return Response({'code': 'insufficient_stock', 'products': e.products}, status=400)
+        return self._detail_response(invoice)
+
+    @action(detail=True, methods=['get', 'post', 'put', 'delete'], permission_classes=[IsCompanyOwner])
+    def cart(self, request, pk=None):
+        """Draft cart kept in the cache instead of InvoiceItem rows until confirm.
+
+        GET shows it, POST adds {"items": [...]} to it, PUT replaces it and
+        DELETE empties it.
+        """
+        invoice = self.get_object()
+        if invoice.status != Invoice.DRAFT:
+            return Response({'detail': 'Invoice not in draft state'}, status=400)
+        if request.method == 'DELETE':
+            clear_cart(invoice.pk)
+            lines = {}
+        elif request.method in ('POST', 'PUT'):
+            try:
+                lines = parse_lines(request.data.get('items'))
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=400)
+            if Product.objects.filter(company_id=invoice.company_id, id__in=lines).count() != len(lines):
+                return Response({'detail': 'product_not_found'}, status=404)
+            if request.method == 'POST':
+                lines = add_to_cart(invoice.pk, lines)
+            else:
+                set_cart(invoice.pk, lines)
+        else:
+            lines = get_cart(invoice.pk)
+
+        products = Product.objects.filter(company_id=invoice.company_id, id__in=lines).in_bulk()
+        items = [{
+            'product': product_id,
+            'product_name': products[product_id].name,
+            'product_sku': products[product_id].sku,
+            'qty': str(qty),
+            'price': str(products[product_id].price),
+            'line_total': str(qty * products[product_id].price),
+            'available': products[product_id].stock_qty,
+        } for product_id, qty in lines.items() if product_id in products]
+        return Response({
+            'invoice_id': invoice.id,
+            'items': items,
+            'total_amount': str(sum((qty * products[pid].price for pid, qty in lines.items() if pid in products), 0)),
+        })
 
     @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
     @transaction.atomic
@@ -219,28 +439,45 @@ class InvoiceViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
         invoice = self.get_object()
         if invoice.status != Invoice.DRAFT:
             return Response({'detail': 'Invoice not in draft state'}, status=400)
-        insufficient = []
-        for it in invoice.items.select_related('product'):
-            if it.product.stock_qty < it.qty:
-                insufficient.append({'product_name': it.product.name, 'required': float(it.qty), 'available': it.product.stock_qty})
-        if insufficient:
-            return Response({'code': 'insufficient_stock_for_confirmation', 'products': insufficient}, status=400)
-        for it in invoice.items.select_related('product'):
-            it.product.stock_qty -= int(it.qty)
-            it.product.save(update_fields=['stock_qty'])
-        invoice.status = Invoice.CONFIRMED
-        invoice.save(update_fields=['status'])
-        # Update customer balance
         try:
-            update_customer_balance(invoice.customer, invoice.company)
-        except Exception:
-            pass
+            if not confirm_invoice(invoice):
+                return Response({'detail': 'Invoice not in draft state'}, status=400)
+        except InsufficientStock as e:
+            return Response({'code': 'insufficient_stock_for_confirmation', 'products': e.products}, status=400)
         return Response({'invoice_id': invoice.id, 'status': invoice.status})
 
+    @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
+    @transaction.atomic
+    def cancel(self, request, pk=None):
+        """Cancel a draft or confirmed invoice; confirmed ones give their stock back"""
+        invoice = self.get_object()
+        if invoice.status == Invoice.CANCELLED:
+            return Response({'detail': 'Invoice already cancelled'}, status=400)
+        if invoice.returns.exclude(status='rejected').exists():
+            # Returned goods and credits are already accounted for; cancelling would count them twice
+            return Response({'detail': 'invoice_has_returns'}, status=400)
+        if not cancel_invoice(invoice):
+            return Response({'detail': 'Invoice already cancelled'}, status=400)
+        return Response({'invoice_id': invoice.id, 'status': invoice.status})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsCompanyOwner])
+    @idempotent
+    def bulk_confirm(self, request):
+        """Confirm many drafts at once: {"ids": [...]}; stock is checked across all of them"""
+        try:
+            ids = self.bulk_ids(request, 'invoice')
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        confirmed, failed = self.run_bulk(ids, confirm_invoices)
+        return Response({
+            'confirmed': confirmed,
+            'failed': [{'invoice_id': pk, **failure} for pk, failure in failed],
+        })
+
     # Removed PDF action; printing/export is handled on the frontend
 
 
-class ReturnViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
+class ReturnViewSet(BulkActionMixin, CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = ReturnSerializer
     queryset = Return.objects.select_related('customer', 'original_invoice')
     permission_classes = [IsCompanyStaff]
@@ -261,6 +498,8 @@ class ReturnViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
             qs = qs.filter(q)
         return qs
 
+    @idempotent
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         data = request.data
         invoice_id = data.get('original_invoice') or data.get('invoice_id')
@@ -269,58 +508,67 @@ class ReturnViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
         if not invoice_id or not items:
             return Response({'detail': 'invoice_id (or original_invoice) and items are required'}, status=400)
         try:
-            invoice = company_queryset(Invoice, request.user).get(id=invoice_id)
+            invoice = company_queryset(Invoice, request.user).select_related('company', 'customer').get(id=invoice_id)
         except Invoice.DoesNotExist:
             return Response({'detail': 'invoice_not_found'}, status=404)
-        return_obj = Return.objects.create(
-            company=invoice.company,
-            original_invoice=invoice,
-            customer=invoice.customer,
-            notes=notes,
-            created_by=request.user
-        )
-        total_amount = 0
-        for item in items:
-            original_item_id = item.get('original_item_id') or item.get('original_item')
-            qty_returned = item.get('qty_returned') or item.get('qty')
-            try:
-                original_item = InvoiceItem.objects.get(id=original_item_id, invoice=invoice)
-            except InvoiceItem.DoesNotExist:
-                return Response({'detail': f'invoice_item_not_found:{original_item_id}'}, status=404)
-            if float(qty_returned) > float(original_item.qty):
-                return Response({'detail': 'qty_returned_exceeds_sold', 'original_qty': float(original_item.qty)}, status=400)
-            ret_item = ReturnItem.objects.create(
-                return_obj=return_obj,
-                original_item=original_item,
-                product=original_item.product,
-                qty_returned=qty_returned,
-                unit_price=original_item.price_at_add
-            )
-            total_amount += float(ret_item.line_total)
-        return_obj.total_amount = total_amount
-        return_obj.save(update_fields=['total_amount'])
+        if invoice.status == Invoice.CANCELLED:
+            return Response({'detail': 'invoice_cancelled'}, status=400)
+        try:
+            return_obj = create_return(invoice, parse_return_lines(items), request.user, notes)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        except InvoiceItem.DoesNotExist as e:
+            return Response({'detail': str(e)}, status=404)
+        except ReturnExceedsSold as e:
+            return Response({'detail': 'qty_returned_exceeds_sold', 'original_qty': float(e.original_qty), 'already_returned': float(e.already_returned)}, status=400)
         serializer = self.get_serializer(return_obj)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_customer = serializer.instance.customer
+        return_obj = serializer.save()
+        if return_obj.status == 'approved' and return_obj.customer_id != previous_customer.id:
+            post_entry(previous_customer, return_obj.company, CustomerLedgerEntry.ADJUSTMENT, return_obj.id, 'return_customer_changed', returns=-return_obj.total_amount)
+            post_entry(return_obj.customer, return_obj.company, CustomerLedgerEntry.RETURN, return_obj.id, return_obj.return_number, returns=return_obj.total_amount)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance_id = instance.pk
+        if instance.status == 'approved':
+            record_returned_quantities(returned_quantities([instance_id]), sign=-1)
+        instance.delete()
+        if instance.status == 'approved':
+            post_entry(instance.customer, instance.company, CustomerLedgerEntry.ADJUSTMENT, instance_id, 'return_deleted', returns=-instance.total_amount)
+
     @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
+    @transaction.atomic
     def approve(self, request, pk=None):
         return_obj = self.get_object()
         if return_obj.status != 'pending':
             return Response({'detail': 'Only pending returns can be approved'}, status=400)
-        return_obj.status = 'approved'
-        return_obj.approved_by = request.user
-        return_obj.approved_at = return_obj.approved_at or return_obj.return_date
-        return_obj.save()
-        for item in return_obj.items.all():
-            product = item.product
-            product.stock_qty += item.qty_returned
-            product.save(update_fields=['stock_qty'])
+        approved, failures = approve_returns([return_obj.id], request.user)
+        if not approved:
+            failure = failures[return_obj.id]
+            if failure['code'] == 'not_pending':
+                return Response({'detail': 'Only pending returns can be approved'}, status=400)
+            return Response({'detail': failure['code'], 'original_item': failure.get('original_item')}, status=400)
+        return Response({'status': 'approved'})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsCompanyOwner])
+    @idempotent
+    def bulk_approve(self, request):
+        """Approve many pending returns at once: {"ids": [...]}"""
         try:
-            update_customer_balance(return_obj.customer, return_obj.company)
-        except Exception:
-            pass
-        return Response({'status': return_obj.status})
+            ids = self.bulk_ids(request, 'return')
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        approved, failed = self.run_bulk(ids, lambda found: approve_returns(found, request.user))
+        return Response({
+            'approved': approved,
+            'failed': [{'return_id': pk, **failure} for pk, failure in failed],
+        })
 
     @action(detail=True, methods=['post'], permission_classes=[IsCompanyOwner])
     def reject(self, request, pk=None):
@@ -334,13 +582,20 @@ class ReturnViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
         return Response({'status': return_obj.status})
 
 
-class PaymentViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
+class PaymentViewSet(ExportMixin, CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
     queryset = Payment.objects.select_related('customer', 'invoice')
     permission_classes = [ReadOnlyOrOwner]
     filterset_fields = ['customer', 'invoice', 'payment_method']
     ordering_fields = ['payment_date', 'amount']
+    export_fields = ('id', 'customer_id', 'customer_name', 'invoice_id', 'amount', 'payment_method', 'payment_date', 'notes')
+    export_annotations = {'customer_name': F('customer__name')}
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @transaction.atomic
     def perform_create(self, serializer):
         company = getattr(self.request.user, 'company', None)
         if not company:
@@ -348,10 +603,23 @@ class PaymentViewSet(CompanyScopedQuerysetMixin, viewsets.ModelViewSet):
             if customer:
                 company = customer.company
         payment = serializer.save(company=company, created_by=self.request.user)
-        try:
-            update_customer_balance(payment.customer, payment.company)
-        except Exception:
-            pass
+        post_entry(payment.customer, payment.company, CustomerLedgerEntry.PAYMENT, payment.id, paid=payment.amount)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_customer, previous_amount = serializer.instance.customer, serializer.instance.amount
+        payment = serializer.save()
+        if payment.customer_id != previous_customer.id:
+            post_entry(previous_customer, payment.company, CustomerLedgerEntry.ADJUSTMENT, payment.id, 'payment_customer_changed', paid=-previous_amount)
+            post_entry(payment.customer, payment.company, CustomerLedgerEntry.PAYMENT, payment.id, paid=payment.amount)
+        else:
+            post_entry(payment.customer, payment.company, CustomerLedgerEntry.ADJUSTMENT, payment.id, 'payment_updated', paid=payment.amount - previous_amount)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance_id = instance.pk
+        instance.delete()
+        post_entry(instance.customer, instance.company, CustomerLedgerEntry.ADJUSTMENT, instance_id, 'payment_deleted', paid=-instance.amount)
 
     def get_queryset(self):
         qs = super().get_queryset().select_related('customer', 'invoice')
@@ -373,6 +641,53 @@ class CustomerBalanceViewSet(CompanyScopedQuerysetMixin, mixins.ListModelMixin,
     queryset = CustomerBalance.objects.select_related('customer')
     permission_classes = [IsCompanyStaff]
 
+    @action(detail=False, methods=['get'], url_path='as-of')
+    def as_of(self, request):
+        """Customer balances at the end of ?date= (optionally one ?customer=)"""
+        company = getattr(request.user, 'company', None)
+        if not company:
+            return Response({'detail': 'company_required'}, status=400)
+        as_of_date = parse_date(request.query_params.get('date') or '')
+        if as_of_date is None:
+            return Response({'detail': 'date is required (YYYY-MM-DD)'}, status=400)
+        customer_id = request.query_params.get('customer')
+        if customer_id is not None:
+            try:
+                customer_id = int(customer_id)
+            except ValueError:
+                return Response({'detail': 'invalid_customer'}, status=400)
+
+        balances = balances_before(company.id, period_start(as_of_date + timedelta(days=1)), customer_id=customer_id)
+        names = dict(Customer.objects.filter(company=company, id__in=list(balances)).values_list('id', 'name'))
+        rows = sorted(balances.items(), key=lambda row: row[1], reverse=True)
+        return Response({
+            'date': as_of_date.isoformat(),
+            'outstanding_receivables': float(sum(b for b in balances.values() if b > 0)),
+            'results': [{
+                'customer': cid,
+                'customer_name': names.get(cid),
+                'balance': float(balance),
+            } for cid, balance in rows if balance or customer_id is not None],
+        })
+
+    @action(detail=False, methods=['get'])
+    def aging(self, request):
+        """Receivables aging report; ?refresh=1 rebuilds it for the user's company first"""
+        company = getattr(request.user, 'company', None)
+        if company and str(request.query_params.get('refresh', '')).lower() in ['1', 'true', 'yes']:
+            refresh_company_aging(company.id)
+        rows = list(company_queryset(ReceivableAging, request.user).select_related('customer').order_by('-total'))
+        buckets = [name for _, name in AGING_BUCKETS] + ['total']
+        return Response({
+            'refreshed_at': max((r.refreshed_at for r in rows), default=None),
+            'totals': {name: float(sum(getattr(r, name) for r in rows)) for name in buckets},
+            'results': [{
+                'customer': r.customer_id,
+                'customer_name': r.customer.name,
+                **{name: float(getattr(r, name)) for name in buckets},
+            } for r in rows],
+        })
+
 
 class UsersViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
@@ -605,6 +920,84 @@ class DashboardStatsView(APIView):
         })
 
 
+class CheckoutView(APIView):
+    """Counter sale in one request: invoice, lines, confirmation and optional payment.
+
+    Body: {"customer": id, "items": [{"product": id, "qty": n}, ...],
+    "payment": {"amount": x, "payment_method": "cash", "notes": ""}}.
+    Everything runs in one transaction and the invoice and payment are posted
+    to the customer's balance as a single delta.
+    """
+    permission_classes = [IsCompanyOwner]
+
+    @idempotent
+    @transaction.atomic
+    def post(self, request):
+        customer = company_queryset(Customer, request.user).select_related('company').filter(
+            pk=request.data.get('customer') or request.data.get('customer_id')
+        ).first()
+        if customer is None:
+            return Response({'detail': 'customer_not_found'}, status=404)
+        try:
+            lines = parse_lines(request.data.get('items'))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+
+        payment_data = request.data.get('payment') or {}
+        if not isinstance(payment_data, dict):
+            return Response({'detail': 'invalid_payment'}, status=400)
+        payment_method = payment_data.get('payment_method', 'cash')
+        if not isinstance(payment_method, str) or payment_method not in dict(Payment.PAYMENT_METHODS):
+            return Response({'detail': 'invalid_payment_method'}, status=400)
+        try:
+            # Same bounds as Payment.amount, so what is posted to the balance is what gets stored
+            paid = serializers.DecimalField(max_digits=12, decimal_places=4, min_value=0).run_validation(
+                payment_data.get('amount', 0)
+            )
+        except serializers.ValidationError:
+            return Response({'detail': 'invalid_payment_amount'}, status=400)
+
+        invoice = Invoice.objects.create(company=customer.company, customer=customer)
+        try:
+            items = add_lines(invoice, lines)
+            confirm_invoice(invoice, post=False)
+        except Product.DoesNotExist:
+            transaction.set_rollback(True)
+            return Response({'detail': 'product_not_found'}, status=404)
+        except InsufficientStock as e:
+            transaction.set_rollback(True)
+            return Response({'code': 'insufficient_stock', 'products': e.products}, status=400)
+
+        entries = [invoice_entry(invoice)]
+        payment = None
+        if paid:
+            payment = Payment.objects.create(
+                company=customer.company, customer=customer, invoice=invoice, amount=paid,
+                payment_method=payment_method, notes=payment_data.get('notes', ''), created_by=request.user,
+            )
+            entries.append({'entry_type': CustomerLedgerEntry.PAYMENT, 'source_id': payment.id, 'paid': paid})
+        posted = post_entries(customer, customer.company, entries)
+
+        return Response({
+            'invoice_id': invoice.id,
+            'status': invoice.status,
+            'customer': customer.id,
+            'customer_name': customer.name,
+            'created_at': invoice.created_at,
+            'items': [{
+                'product': item.product_id,
+                'product_name': item.product.name,
+                'qty': str(item.qty),
+                'price': str(item.price_at_add),
+                'line_total': str(item.qty * item.price_at_add),
+            } for item in items],
+            'total_amount': str(invoice.total_amount),
+            'paid': str(paid),
+            'payment_id': payment.id if payment else None,
+            'balance': str(posted[-1].balance) if posted else None,
+        }, status=status.HTTP_201_CREATED)
+
+
 class CompanyRegisterView(APIView):
     permission_classes: list = []  # public
 
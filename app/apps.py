@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from .lookup import invalidate_product_lookup
+        from .search import ensure_search_index
+
+        post_migrate.connect(ensure_search_index, sender=self)
+        post_save.connect(invalidate_product_lookup, sender='app.Product')
+        post_delete.connect(invalidate_product_lookup, sender='app.Product')
@@ -0,0 +1,277 @@
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Max, Min, Sum, Value, When
+from django.utils import timezone
+
+from .models import (
+    CustomerBalance, CustomerBalanceCheckpoint, CustomerLedgerEntry, Invoice, Payment, ReceivableAging, Return
+)
+
+
+def customer_totals(customer, company):
+    """Aggregate invoiced/paid/returned totals for one customer in the database"""
+    total_invoiced = Invoice.objects.filter(
+        customer=customer, company=company, status=Invoice.CONFIRMED
+    ).aggregate(total=Sum('total_amount'))['total'] or 0
+    total_paid = Payment.objects.filter(
+        customer=customer, company=company
+    ).aggregate(total=Sum('amount'))['total'] or 0
+    total_returns = Return.objects.filter(
+        customer=customer, company=company, status='approved'
+    ).aggregate(total=Sum('total_amount'))['total'] or 0
+    return {
+        'total_invoiced': total_invoiced,
+        'total_paid': total_paid,
+        'total_returns': total_returns,
+        'balance': total_invoiced - total_paid - total_returns,
+    }
+
+
+BALANCE_FIELDS = (('invoiced', 'total_invoiced'), ('paid', 'total_paid'), ('returns', 'total_returns'))
+
+
+def _balance_updates(deltas):
+    """``UPDATE`` kwargs adding ``{customer_id: {'invoiced': x, 'paid': y, 'returns': z}}`` per row"""
+    def per_customer(value):
+        return Case(
+            *[When(customer_id=customer_id, then=Value(value(delta))) for customer_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=DecimalField(max_digits=12, decimal_places=4),
+        )
+
+    updates = {
+        field: F(field) + per_customer(lambda delta, key=key: delta.get(key, 0))
+        for key, field in BALANCE_FIELDS
+    }
+    updates['balance'] = F('balance') + per_customer(
+        lambda delta: delta.get('invoiced', 0) - delta.get('paid', 0) - delta.get('returns', 0)
+    )
+    updates['last_updated'] = timezone.now()
+    return updates
+
+
+def apply_balance_deltas(company, deltas):
+    """Apply signed ``{customer_id: {'invoiced': x, 'paid': y, 'returns': z}}`` deltas to balance rows"""
+    deltas = {customer_id: delta for customer_id, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+    if CustomerBalance.objects.filter(customer_id__in=list(deltas)).update(**_balance_updates(deltas)) == len(deltas):
+        return
+    # Missing rows are seeded from the aggregates, which already include this transaction's writes
+    existing = set(CustomerBalance.objects.filter(customer_id__in=list(deltas)).values_list('customer_id', flat=True))
+    for customer_id in set(deltas) - existing:
+        try:
+            with transaction.atomic():
+                CustomerBalance.objects.create(customer_id=customer_id, company=company, **customer_totals(customer_id, company))
+        except IntegrityError:
+            # A concurrent writer seeded the row without seeing our uncommitted write
+            CustomerBalance.objects.filter(customer_id=customer_id).update(**_balance_updates({customer_id: deltas[customer_id]}))
+
+
+def post_company_entries(company, entries):
+    """Apply the balance deltas of many ledger entries and append them with their running balances"""
+    entries = [e for e in entries if e.get('invoiced') or e.get('paid') or e.get('returns')]
+    if not entries:
+        return []
+    deltas = {}
+    for entry in entries:
+        delta = deltas.setdefault(entry['customer_id'], {'invoiced': 0, 'paid': 0, 'returns': 0})
+        for key in delta:
+            delta[key] += entry.get(key, 0)
+    apply_balance_deltas(company, deltas)
+
+    running = dict(CustomerBalance.objects.filter(customer_id__in=list(deltas)).values_list('customer_id', 'balance'))
+    for customer_id, delta in deltas.items():
+        running[customer_id] = running.get(customer_id, 0) - (delta['invoiced'] - delta['paid'] - delta['returns'])
+
+    rows = []
+    for entry in entries:
+        amount = entry.get('invoiced', 0) - entry.get('paid', 0) - entry.get('returns', 0)
+        running[entry['customer_id']] += amount
+        rows.append(CustomerLedgerEntry(
+            company=company,
+            customer_id=entry['customer_id'],
+            entry_type=entry['entry_type'],
+            source_id=entry.get('source_id'),
+            reference=entry.get('reference', ''),
+            amount=amount,
+            balance=running[entry['customer_id']],
+        ))
+    return CustomerLedgerEntry.objects.bulk_create(rows, batch_size=500)
+
+
+def post_entries(customer, company, entries):
+    """Post several ledger entries of one customer with a single balance delta"""
+    return post_company_entries(company, [{**entry, 'customer_id': customer.pk} for entry in entries])
+
+
+def post_entry(customer, company, entry_type, source_id=None, reference='', invoiced=0, paid=0, returns=0):
+    """Apply a balance delta and append the matching ledger entry"""
+    entries = post_entries(customer, company, [{
+        'entry_type': entry_type, 'source_id': source_id, 'reference': reference,
+        'invoiced': invoiced, 'paid': paid, 'returns': returns,
+    }])
+    return entries[0] if entries else None
+
+
+def _grouped_totals(queryset, field):
+    rows = queryset.order_by().values('customer_id').annotate(total=Sum(field)).values_list('customer_id', 'total')
+    return {customer_id: total or 0 for customer_id, total in rows}
+
+
+def rebuild_company_balances(company_id, dry_run=False):
+    """Rebuild a company's CustomerBalance rows from aggregates and report the ones that had drifted"""
+    invoiced = _grouped_totals(Invoice.objects.filter(company_id=company_id, status=Invoice.CONFIRMED), 'total_amount')
+    paid = _grouped_totals(Payment.objects.filter(company_id=company_id), 'amount')
+    returned = _grouped_totals(Return.objects.filter(company_id=company_id, status='approved'), 'total_amount')
+
+    now = timezone.now()
+    to_create, to_update, drifted = [], [], []
+    with transaction.atomic():
+        existing = {b.customer_id: b for b in CustomerBalance.objects.filter(company_id=company_id)}
+        for customer_id in set(invoiced) | set(paid) | set(returned) | set(existing):
+            totals = {
+                'total_invoiced': invoiced.get(customer_id, 0),
+                'total_paid': paid.get(customer_id, 0),
+                'total_returns': returned.get(customer_id, 0),
+            }
+            totals['balance'] = totals['total_invoiced'] - totals['total_paid'] - totals['total_returns']
+            row = existing.get(customer_id)
+            if row is None:
+                to_create.append(CustomerBalance(company_id=company_id, customer_id=customer_id, **totals))
+                continue
+            if all(getattr(row, field) == value for field, value in totals.items()):
+                continue
+            drifted.append({'customer_id': customer_id, 'stored': row.balance, 'actual': totals['balance']})
+            for field, value in totals.items():
+                setattr(row, field, value)
+            row.last_updated = now
+            to_update.append(row)
+        if not dry_run:
+            CustomerBalance.objects.bulk_create(to_create, batch_size=500)
+            CustomerBalance.objects.bulk_update(
+                to_update, ['total_invoiced', 'total_paid', 'total_returns', 'balance', 'last_updated'], batch_size=500
+            )
+    return {
+        'company_id': company_id,
+        'created': len(to_create),
+        'updated': len(to_update),
+        'drifted': drifted,
+    }
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def next_month(period):
+    return month_start(period + timedelta(days=32))
+
+
+def period_start(period):
+    """Aware datetime at midnight of ``period`` (a date)"""
+    return timezone.make_aware(datetime.combine(period, time.min))
+
+
+def balances_before(company_id, moment, customer_id=None):
+    """Customer balances before ``moment``: the latest checkpoint plus the ledger entries since"""
+    checkpoints = CustomerBalanceCheckpoint.objects.filter(
+        company_id=company_id, period__lte=timezone.localtime(moment).date()
+    )
+    entries = CustomerLedgerEntry.objects.filter(company_id=company_id, created_at__lt=moment)
+    if customer_id is not None:
+        checkpoints = checkpoints.filter(customer_id=customer_id)
+        entries = entries.filter(customer_id=customer_id)
+
+    balances = {}
+    period = checkpoints.aggregate(period=Max('period'))['period']
+    if period is not None:
+        balances.update(checkpoints.filter(period=period).values_list('customer_id', 'balance'))
+        entries = entries.filter(created_at__gte=period_start(period))
+    for entry_customer_id, total in _grouped_totals(entries, 'amount').items():
+        balances[entry_customer_id] = balances.get(entry_customer_id, 0) + total
+    return balances
+
+
+def checkpoint_company_balances(company_id, until=None):
+    """Write a company's missing monthly checkpoints up to ``until``'s month"""
+    until = month_start(until or timezone.localdate())
+    last = CustomerBalanceCheckpoint.objects.filter(company_id=company_id).aggregate(period=Max('period'))['period']
+    if last is None:
+        first = CustomerLedgerEntry.objects.filter(company_id=company_id).aggregate(first=Min('created_at'))['first']
+        if first is None:
+            return 0
+        # Nothing is owed before the first entry, so the first checkpoint is the month after it
+        last = month_start(timezone.localtime(first).date())
+
+    written = 0
+    period = next_month(last)
+    while period <= until:
+        balances = balances_before(company_id, period_start(period))
+        CustomerBalanceCheckpoint.objects.bulk_create(
+            [
+                CustomerBalanceCheckpoint(company_id=company_id, customer_id=customer_id, period=period, balance=balance)
+                for customer_id, balance in balances.items()
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['customer', 'period'],
+            update_fields=['balance'],
+        )
+        written += 1
+        period = next_month(period)
+    return written
+
+
+AGING_BUCKETS = (
+    (30, 'current'),
+    (60, 'days_31_60'),
+    (90, 'days_61_90'),
+    (None, 'days_over_90'),
+)
+
+
+def _aging_row(company_id, customer_id, open_invoices, today, now):
+    row = ReceivableAging(company_id=company_id, customer_id=customer_id, refreshed_at=now)
+    for created_at, amount in open_invoices:
+        age = (today - timezone.localtime(created_at).date()).days
+        field = next(name for limit, name in AGING_BUCKETS if limit is None or age <= limit)
+        setattr(row, field, getattr(row, field) + amount)
+        row.total += amount
+    return row
+
+
+def refresh_company_aging(company_id):
+    """Rebuild a company's aging rows, allocating payments and returns to the oldest invoices first"""
+    credits = {
+        customer_id: paid + returned
+        for customer_id, paid, returned in CustomerBalance.objects.filter(company_id=company_id)
+        .values_list('customer_id', 'total_paid', 'total_returns')
+    }
+    invoices = (
+        Invoice.objects.filter(company_id=company_id, status=Invoice.CONFIRMED)
+        .order_by('customer_id', 'created_at', 'id')
+        .values_list('customer_id', 'created_at', 'total_amount')
+    )
+
+    now = timezone.now()
+    today = timezone.localdate()
+    rows, open_invoices = [], []
+    current_customer, remaining_credit = None, 0
+    for customer_id, created_at, amount in invoices.iterator(chunk_size=2000):
+        if customer_id != current_customer:
+            if open_invoices:
+                rows.append(_aging_row(company_id, current_customer, open_invoices, today, now))
+            current_customer, remaining_credit, open_invoices = customer_id, credits.get(customer_id, 0), []
+        applied = min(amount, remaining_credit)
+        remaining_credit -= applied
+        if amount - applied > 0:
+            open_invoices.append((created_at, amount - applied))
+    if open_invoices:
+        rows.append(_aging_row(company_id, current_customer, open_invoices, today, now))
+
+    with transaction.atomic():
+        ReceivableAging.objects.filter(company_id=company_id).delete()
+        ReceivableAging.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
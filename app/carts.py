@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+
+
+def _key(invoice_id):
+    return f'invoice-cart:{invoice_id}'
+
+
+def get_cart(invoice_id):
+    """Draft lines kept in the cart cache as ``{product_id: qty}``"""
+    raw = _cache().get(_key(invoice_id)) or {}
+    return {int(product_id): Decimal(qty) for product_id, qty in raw.items()}
+
+
+def set_cart(invoice_id, lines):
+    if not lines:
+        clear_cart(invoice_id)
+        return
+    _cache().set(_key(invoice_id), {str(product_id): str(qty) for product_id, qty in lines.items()})
+
+
+def add_to_cart(invoice_id, lines):
+    cart = get_cart(invoice_id)
+    for product_id, qty in lines.items():
+        cart[product_id] = cart.get(product_id, 0) + qty
+    set_cart(invoice_id, cart)
+    return cart
+
+
+def clear_cart(invoice_id):
+    _cache().delete(_key(invoice_id))
+
+
+def clear_carts(invoice_ids):
+    _cache().delete_many([_key(invoice_id) for invoice_id in invoice_ids])
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _claim(request, key, now):
+    """Insert the key in its own transaction; returns None if it already exists"""
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=request.user,
+                key=key,
+                method=request.method,
+                path=request.path,
+                expires_at=now + getattr(settings, 'IDEMPOTENCY_KEY_TTL', timedelta(hours=24)),
+            )
+    except IntegrityError:
+        return None
+
+
+def idempotent(view_method):
+    """Replay the stored response when a request is retried with the same Idempotency-Key"""
+    @wraps(view_method)
+    def _wrapped_view(self, request, *args, **kwargs):
+        key = (request.headers.get(IDEMPOTENCY_HEADER) or '').strip()
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 128:
+            return Response({'detail': 'idempotency_key_too_long'}, status=400)
+
+        # The key is claimed before the view runs, so a concurrent duplicate gets a 409 instead of a second write
+        now = timezone.now()
+        IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+        record = _claim(request, key, now)
+        if record is None:
+            stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if stored is None:
+                return Response({'detail': 'idempotency_key_in_use'}, status=409)
+            if stored.method != request.method or stored.path != request.path:
+                return Response({'detail': 'idempotency_key_reused'}, status=422)
+            if stored.status_code is None:
+                return Response({'detail': 'request_in_progress'}, status=409)
+            return Response(stored.response_body, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        # Only successful responses are kept; on errors the key is released so the client may retry
+        if 200 <= response.status_code < 300:
+            record.status_code = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['status_code', 'response_body'])
+        else:
+            record.delete()
+        return response
+    return _wrapped_view
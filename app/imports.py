@@ -0,0 +1,283 @@
+import codecs
+import csv
+import zipfile
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+
+from .models import Category, Product
+from .search import product_search_text
+
+# Rows validated and inserted per transaction
+IMPORT_BATCH_SIZE = 500
+# Row errors kept in the report; the error count is always exact
+MAX_REPORTED_ERRORS = 1000
+# Bytes of a CSV read up front to tell UTF-8 from cp1256
+CSV_SNIFF_BYTES = 64 * 1024
+
+IMPORT_COLUMNS = (
+    'name', 'price', 'stock_qty', 'category', 'sku', 'barcode', 'unit', 'measurement', 'description',
+    'cost_price', 'wholesale_price', 'retail_price',
+)
+# Header spellings accepted besides the column names themselves
+_COLUMN_ALIASES = {
+    'category_name': 'category', 'qty': 'stock_qty', 'stock': 'stock_qty',
+    'الاسم': 'name', 'اسم المنتج': 'name', 'السعر': 'price', 'الكمية': 'stock_qty', 'الفئة': 'category',
+    'الرمز': 'sku', 'رمز المنتج': 'sku', 'الباركود': 'barcode', 'الوحدة': 'unit', 'القياس': 'measurement',
+    'الوصف': 'description', 'سعر التكلفة': 'cost_price', 'سعر الجملة': 'wholesale_price', 'سعر المفرق': 'retail_price',
+}
+# Price columns are DecimalField(max_digits=12, decimal_places=4)
+_MAX_AMOUNT = Decimal(10) ** 8
+_UNITS = {**{key: key for key, _ in Product.UNIT_CHOICES}, **{label: key for key, label in Product.UNIT_CHOICES}}
+
+
+class ImportFormatError(ValueError):
+    """The file cannot be read as a product sheet (unknown format, missing required columns)"""
+
+    def __init__(self, code, **extra):
+        super().__init__(code)
+        self.code = code
+        self.extra = extra
+
+
+def _csv_encoding(file):
+    """UTF-8 (with or without BOM) unless the start of the file says otherwise; then cp1256 (Arabic Excel)"""
+    head = file.read(CSV_SNIFF_BYTES)
+    file.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'cp1256'
+    return 'utf-8-sig'
+
+
+def _csv_rows(file):
+    reader = csv.reader(codecs.iterdecode(file, _csv_encoding(file)))
+    # Decoding and parsing happen lazily, row by row, so their errors surface here
+    try:
+        yield from reader
+    except UnicodeDecodeError:
+        raise ImportFormatError('invalid_encoding', row=reader.line_num + 1)
+    except csv.Error:
+        raise ImportFormatError('invalid_csv', row=reader.line_num)
+
+
+def _xlsx_rows(file):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ImportFormatError('xlsx_not_supported')
+    # read_only streams the sheet row by row instead of loading it whole
+    try:
+        sheet = load_workbook(file, read_only=True, data_only=True).active
+    except (InvalidFileException, zipfile.BadZipFile, KeyError, OSError):
+        raise ImportFormatError('invalid_xlsx')
+    return (['' if value is None else value for value in row] for row in sheet.iter_rows(values_only=True))
+
+
+def read_rows(file, file_format):
+    """Yield ``(row_number, {column: value})`` from a CSV or XLSX file, header row first"""
+    rows = _xlsx_rows(file) if file_format == 'xlsx' else _csv_rows(file)
+    header = next(rows, None)
+    if header is None:
+        raise ImportFormatError('empty_file')
+    columns = []
+    for title in header:
+        title = str(title).strip()
+        columns.append(_COLUMN_ALIASES.get(title, title.lower()))
+    missing = [column for column in ('name', 'price', 'category') if column not in columns]
+    if missing:
+        raise ImportFormatError('missing_columns', columns=missing)
+    for number, row in enumerate(rows, start=2):
+        values = {column: value for column, value in zip(columns, row) if column in IMPORT_COLUMNS}
+        if any(str(value).strip() for value in values.values()):
+            yield number, values
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ''
+
+
+def _decimal(value, errors, field, required=False):
+    text = _text(value)
+    if not text:
+        if required:
+            errors[field] = 'required'
+        return None
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        errors[field] = 'invalid_number'
+        return None
+    if not number.is_finite() or number < 0 or number >= _MAX_AMOUNT:
+        errors[field] = 'invalid_number'
+        return None
+    return number.quantize(Decimal('0.0001'))
+
+
+def _parse_row(values, categories, create_categories):
+    """Product fields of one row and its ``{field: error_code}`` problems"""
+    errors = {}
+    fields = {}
+    name = _text(values.get('name'))
+    if not name:
+        errors['name'] = 'required'
+    fields['name'] = name[:256]
+    fields['price'] = _decimal(values.get('price'), errors, 'price', required=True)
+    stock_qty = _decimal(values.get('stock_qty'), errors, 'stock_qty')
+    if stock_qty is not None and stock_qty != stock_qty.to_integral_value():
+        errors['stock_qty'] = 'invalid_number'
+    fields['stock_qty'] = int(stock_qty or 0) if 'stock_qty' not in errors else 0
+    for field in ('cost_price', 'wholesale_price', 'retail_price'):
+        fields[field] = _decimal(values.get(field), errors, field)
+
+    category = _text(values.get('category'))[:128]
+    if not category:
+        errors['category'] = 'required'
+    elif category.casefold() not in categories and not create_categories:
+        errors['category'] = 'category_not_found'
+    fields['category'] = category
+
+    unit = _text(values.get('unit'))
+    if unit and unit.lower() not in _UNITS and unit not in _UNITS:
+        errors['unit'] = 'invalid_unit'
+    fields['unit'] = _UNITS.get(unit.lower(), _UNITS.get(unit)) if unit else 'piece'
+
+    for field, max_length in (('sku', 64), ('barcode', 64), ('measurement', 100)):
+        text = _text(values.get(field))
+        if len(text) > max_length:
+            errors[field] = 'too_long'
+        fields[field] = text or None
+    fields['description'] = _text(values.get('description')) or None
+    return fields, errors
+
+
+class ProductImport:
+    """Streams rows into a company's products, ``batch_size`` rows per transaction; bad rows are reported and skipped"""
+
+    def __init__(self, company, batch_size=IMPORT_BATCH_SIZE, create_categories=False, dry_run=False):
+        self.company = company
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self.dry_run = dry_run
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        # Codes claimed by earlier rows of the file
+        self.seen = {'sku': set(), 'barcode': set()}
+        self.categories = {
+            name.casefold(): category_id
+            for category_id, name in Category.objects.filter(company=company).values_list('id', 'name')
+        }
+
+    def report(self):
+        return {
+            'created': self.created,
+            'failed': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'dry_run': self.dry_run,
+        }
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            try:
+                batch = list(islice(rows, self.batch_size))
+            except ImportFormatError as exc:
+                # Earlier batches are already committed; say how far the import got
+                exc.extra['created'] = self.created
+                raise
+            if not batch:
+                return self.report()
+            self._import_batch(batch)
+
+    def _fail(self, number, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def _import_batch(self, batch):
+        parsed = []
+        for number, values in batch:
+            fields, errors = _parse_row(values, self.categories, self.create_categories)
+            parsed.append((number, fields, errors))
+        self._check_unique(parsed, 'sku')
+        self._check_unique(parsed, 'barcode')
+
+        valid = []
+        for number, fields, errors in parsed:
+            if errors:
+                self._fail(number, errors)
+            else:
+                valid.append((number, fields))
+        if self.dry_run:
+            self.created += len(valid)
+            return
+        if not valid:
+            return
+
+        with transaction.atomic():
+            self._create_categories({fields['category'] for _, fields in valid})
+            products = [self._product(fields) for _, fields in valid]
+            Product.assign_skus(products)
+            for product in products:
+                product.search_text = product_search_text(product)
+            try:
+                with transaction.atomic():
+                    Product.objects.bulk_create(products)
+                self.created += len(products)
+                return
+            except IntegrityError:
+                pass
+            # A concurrent write took a code between the check and the insert: find the rows one by one
+            for (number, _), product in zip(valid, products):
+                try:
+                    with transaction.atomic():
+                        product.save()
+                    self.created += 1
+                except IntegrityError:
+                    field = 'sku' if Product.objects.filter(company=self.company, sku=product.sku).exists() else 'barcode'
+                    self._fail(number, {field: f'{field}_already_exists'})
+
+    def _check_unique(self, parsed, field):
+        codes = {fields[field] for _, fields, errors in parsed if fields[field] and field not in errors}
+        taken = set(
+            Product.objects.filter(company=self.company, **{f'{field}__in': codes}).values_list(field, flat=True)
+        ) if codes else set()
+        seen = self.seen[field]
+        for _, fields, errors in parsed:
+            code = fields[field]
+            if not code or field in errors:
+                continue
+            if code in taken or code in seen:
+                errors[field] = f'{field}_already_exists'
+            seen.add(code)
+
+    def _create_categories(self, names):
+        missing = {}
+        for name in names:
+            missing.setdefault(name.casefold(), name)
+        for key in list(missing):
+            if key in self.categories:
+                del missing[key]
+        if not missing:
+            return
+        for category in Category.objects.bulk_create(
+            [Category(company=self.company, name=name[:128]) for name in missing.values()]
+        ):
+            self.categories[category.name.casefold()] = category.id
+
+    def _product(self, fields):
+        return Product(
+            company=self.company,
+            category_id=self.categories[fields['category'].casefold()],
+            **{field: value for field, value in fields.items() if field != 'category'},
+        )
+
+
+def import_products(company, file, file_format='csv', **options):
+    """Import a CSV/XLSX product sheet into ``company``; returns the ProductImport report"""
+    return ProductImport(company, **options).run(read_rows(file, file_format))
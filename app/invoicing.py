@@ -0,0 +1,223 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, When
+from django.utils import timezone
+
+from .balances import post_company_entries, post_entries
+from .carts import clear_cart, clear_carts, get_cart
+from .models import Company, CustomerLedgerEntry, Invoice, InvoiceItem, Product
+from .stock import InsufficientStock, decrement_stock, increment_stock, lock_products
+
+
+def parse_lines(items):
+    """Normalize ``[{product, qty}, ...]`` into ``{product_id: qty}``, raising ValueError on bad input"""
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    lines = defaultdict(Decimal)
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('each item must be an object')
+        product_id = item.get('product') or item.get('product_id')
+        try:
+            product_id = int(product_id)
+            qty = Decimal(str(item.get('qty', 1)))
+        except (TypeError, ValueError, InvalidOperation):
+            raise ValueError('invalid product or qty')
+        if qty <= 0:
+            raise ValueError('qty must be positive')
+        lines[product_id] += qty
+    return dict(lines)
+
+
+def recalculate_total(invoice):
+    """Recompute the invoice's ``total_amount`` from its items"""
+    invoice.total_amount = invoice.items.aggregate(
+        total=Sum(F('qty') * F('price_at_add'))
+    )['total'] or 0
+    invoice.save(update_fields=['total_amount'])
+
+
+def add_lines(invoice, lines):
+    """Add ``{product_id: qty}`` lines to a draft invoice and return the touched lines"""
+    products = Product.objects.filter(company_id=invoice.company_id, id__in=lines).in_bulk()
+    if len(products) != len(lines):
+        raise Product.DoesNotExist('product_not_found')
+    existing, merge_into = defaultdict(Decimal), {}
+    for item in invoice.items.filter(product_id__in=lines).order_by():
+        existing[item.product_id] += item.qty
+        if item.price_at_add == products[item.product_id].price:
+            merge_into[item.product_id] = item
+
+    insufficient = []
+    for product_id, qty in lines.items():
+        product, already = products[product_id], existing.get(product_id, 0)
+        if product.stock_qty < already + qty:
+            insufficient.append({
+                'product': product_id,
+                'product_name': product.name,
+                'available': product.stock_qty,
+                'already_in_invoice': float(already),
+                'can_add': float(max(0, product.stock_qty - already)),
+            })
+    if insufficient:
+        raise InsufficientStock(insufficient)
+
+    # A product already on the invoice at its current price grows that line instead of adding one
+    merged = [merge_into[product_id] for product_id in lines if product_id in merge_into]
+    if merged:
+        InvoiceItem.objects.filter(id__in=[item.id for item in merged]).update(qty=Case(
+            *[When(id=item.id, then=F('qty') + lines[item.product_id]) for item in merged],
+            output_field=DecimalField(max_digits=12, decimal_places=4),
+        ))
+        for item in merged:
+            item.qty += lines[item.product_id]
+            item.product = products[item.product_id]
+    created = InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, product=products[product_id], qty=qty, price_at_add=products[product_id].price)
+        for product_id, qty in lines.items()
+        if product_id not in merge_into
+    ])
+    recalculate_total(invoice)
+    return merged + created
+
+
+def invoice_quantities(invoice):
+    """``{product_id: qty}`` of an invoice's items"""
+    return dict(
+        invoice.items.order_by().values('product_id').annotate(total=Sum('qty')).values_list('product_id', 'total')
+    )
+
+
+def invoice_entry(invoice):
+    """Ledger entry (see ``post_entries``) for a confirmed invoice"""
+    return {
+        'customer_id': invoice.customer_id,
+        'entry_type': CustomerLedgerEntry.INVOICE,
+        'source_id': invoice.id,
+        'invoiced': invoice.total_amount,
+    }
+
+
+def confirm_invoice(invoice, post=True):
+    """Confirm a draft invoice, taking its items out of stock; False if it was no longer a draft"""
+    with transaction.atomic():
+        if not Invoice.objects.filter(pk=invoice.pk, status=Invoice.DRAFT).update(status=Invoice.CONFIRMED):
+            return False
+        cart = get_cart(invoice.pk)
+        if cart:
+            add_lines(invoice, cart)
+            transaction.on_commit(lambda: clear_cart(invoice.pk))
+        decrement_stock(invoice_quantities(invoice))
+        # post=False lets the caller post invoice_entry itself, e.g. together with a payment
+        if post:
+            post_entries(invoice.customer, invoice.company, [invoice_entry(invoice)])
+    invoice.status = Invoice.CONFIRMED
+    return True
+
+
+def cancel_invoice(invoice):
+    """Cancel a draft or confirmed invoice, restocking a confirmed one; False if already cancelled"""
+    previous = invoice.status
+    with transaction.atomic():
+        claimed = Invoice.objects.filter(pk=invoice.pk, status=previous).exclude(status=Invoice.CANCELLED)
+        if not claimed.update(status=Invoice.CANCELLED):
+            return False
+        if previous == Invoice.CONFIRMED:
+            increment_stock(invoice_quantities(invoice))
+            post_entries(invoice.customer, invoice.company, [{
+                'entry_type': CustomerLedgerEntry.ADJUSTMENT,
+                'source_id': invoice.id,
+                'reference': 'invoice_cancelled',
+                'invoiced': -invoice.total_amount,
+            }])
+        else:
+            transaction.on_commit(lambda: clear_cart(invoice.pk))
+    invoice.status = Invoice.CANCELLED
+    return True
+
+
+def confirm_invoices(invoice_ids):
+    """Confirm many drafts in order while stock lasts; returns ``(confirmed_ids, {id: failure})``"""
+    with transaction.atomic():
+        drafts = Invoice.objects.select_for_update().filter(pk__in=invoice_ids, status=Invoice.DRAFT).in_bulk()
+        failures = {pk: {'code': 'not_draft'} for pk in invoice_ids if pk not in drafts}
+
+        for pk, invoice in drafts.items():
+            cart = get_cart(pk)
+            if not cart:
+                continue
+            try:
+                with transaction.atomic():
+                    add_lines(invoice, cart)
+            except Product.DoesNotExist:
+                failures[pk] = {'code': 'product_not_found'}
+                continue
+            except InsufficientStock as e:
+                failures[pk] = {'code': 'insufficient_stock', 'products': e.products}
+                continue
+            # The cart now lives in InvoiceItem rows, whether or not the invoice is confirmed below
+            transaction.on_commit(lambda pk=pk: clear_cart(pk))
+
+        needs = defaultdict(dict)
+        rows = (
+            InvoiceItem.objects.filter(invoice_id__in=[pk for pk in drafts if pk not in failures]).order_by()
+            .values('invoice_id', 'product_id').annotate(total=Sum('qty'))
+            .values_list('invoice_id', 'product_id', 'total')
+        )
+        for invoice_id, product_id, qty in rows:
+            needs[invoice_id][product_id] = qty
+        products = lock_products({product_id for need in needs.values() for product_id in need})
+        available = {product_id: product.stock_qty for product_id, product in products.items()}
+
+        confirmed, quantities = [], defaultdict(Decimal)
+        for pk in invoice_ids:
+            if pk in failures or pk in confirmed:
+                continue
+            need = needs.get(pk, {})
+            insufficient = [
+                {'product': product_id, 'product_name': products[product_id].name, 'required': float(qty), 'available': int(available[product_id])}
+                for product_id, qty in need.items()
+                if available[product_id] < qty
+            ]
+            if insufficient:
+                failures[pk] = {'code': 'insufficient_stock', 'products': insufficient}
+                continue
+            for product_id, qty in need.items():
+                available[product_id] -= qty
+                quantities[product_id] += qty
+            confirmed.append(pk)
+
+        decrement_stock(quantities)
+        Invoice.objects.filter(pk__in=confirmed).update(status=Invoice.CONFIRMED)
+        entries = defaultdict(list)
+        for pk in confirmed:
+            entries[drafts[pk].company_id].append(invoice_entry(drafts[pk]))
+        companies = Company.objects.in_bulk(list(entries))
+        for company_id, company_entries in entries.items():
+            post_company_entries(companies[company_id], company_entries)
+    return confirmed, failures
+
+
+def expire_company_drafts(company_id, ttl_days, batch_size=500, cancel=False):
+    """Delete (or, with ``cancel``, cancel) a company's drafts older than ``ttl_days``, in short batches"""
+    stale = Invoice.objects.filter(
+        company_id=company_id, status=Invoice.DRAFT, created_at__lt=timezone.now() - timedelta(days=ttl_days),
+        returns__isnull=True,
+    ).order_by()
+    removed, last_id = 0, 0
+    while True:
+        ids = list(stale.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        last_id = ids[-1]
+        with transaction.atomic():
+            # Re-check the status: a draft may have been confirmed since it was selected
+            batch = Invoice.objects.filter(id__in=ids, status=Invoice.DRAFT)
+            if cancel:
+                removed += batch.update(status=Invoice.CANCELLED)
+            else:
+                removed += batch.delete()[1].get(Invoice._meta.label, 0)
+            transaction.on_commit(lambda ids=ids: clear_carts(ids))
@@ -0,0 +1,157 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Products rendered per worker task and saved per bulk_update
+QR_BATCH_SIZE = 500
+# Pixels per QR module and quiet-zone width (in modules) of the stored PNGs
+QR_MODULE_PIXELS = 8
+QR_BORDER = 4
+# Largest selection the API renders into one label sheet
+MAX_LABELS_PER_SHEET = 2000
+
+
+def qr_matrix(data):
+    """Dark/light module rows of the QR symbol for ``data`` (medium error correction)"""
+    from reportlab.graphics.barcode import qrencoder
+
+    code = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.M)
+    code.addData(data)
+    code.make()
+    count = code.getModuleCount()
+    return [[code.isDark(row, col) for col in range(count)] for row in range(count)]
+
+
+def render_qr_png(data):
+    """PNG bytes of the QR code for ``data``"""
+    from PIL import Image
+
+    matrix = qr_matrix(data)
+    size = len(matrix) + 2 * QR_BORDER
+    image = Image.new('L', (size, size), 255)
+    image.putdata([
+        0 if QR_BORDER <= row < size - QR_BORDER and QR_BORDER <= col < size - QR_BORDER
+        and matrix[row - QR_BORDER][col - QR_BORDER] else 255
+        for row in range(size) for col in range(size)
+    ])
+    image = image.resize((size * QR_MODULE_PIXELS, size * QR_MODULE_PIXELS), Image.NEAREST).convert('1')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def _render_batch(batch):
+    # Runs in the worker processes: pure rendering, no database or storage access
+    return [(product_id, render_qr_png(code)) for product_id, code in batch]
+
+
+def _batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def generate_qr_codes(products, batch_size=QR_BATCH_SIZE, workers=None, limit=None):
+    """Render and store the missing QR images (encoding the SKU) of ``products``; returns how many"""
+    from .models import Product
+
+    pending = products.filter(qr_code='').exclude(sku__isnull=True).order_by('id')
+    if limit is not None:
+        pending = pending[:limit]
+    rows = list(pending.values_list('id', 'sku'))
+    if not rows:
+        return 0
+    batches = list(_batches(rows, batch_size))
+    workers = min(workers or os.cpu_count() or 1, len(batches))
+
+    generated = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        rendered = executor.map(_render_batch, batches) if executor else map(_render_batch, batches)
+        for batch in rendered:
+            updated = [
+                Product(pk=product_id, qr_code=default_storage.save(
+                    f'{Product._meta.get_field("qr_code").upload_to}product-{product_id}.png', ContentFile(png)
+                ))
+                for product_id, png in batch
+            ]
+            Product.objects.bulk_update(updated, ['qr_code'])
+            generated += len(updated)
+    finally:
+        if executor:
+            executor.shutdown()
+    return generated
+
+
+# A4 sheet of 3 x 8 labels (70 x 37 mm), the common adhesive label layout
+LABEL_COLUMNS, LABEL_ROWS = 3, 8
+
+
+def _label_font():
+    """Font registered for label text: settings.LABEL_FONT_PATH (a TTF covering Arabic) or Helvetica"""
+    font_path = getattr(settings, 'LABEL_FONT_PATH', None)
+    if not font_path:
+        return 'Helvetica', False
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    if 'LabelFont' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('LabelFont', font_path))
+    return 'LabelFont', True
+
+
+def _label_text(text, shaped):
+    if shaped:
+        import arabic_reshaper
+        from bidi.algorithm import get_display
+
+        return get_display(arabic_reshaper.reshape(text))
+    # Helvetica has no Arabic glyphs; keep whatever it can draw
+    return text.encode('latin-1', 'ignore').decode('latin-1').strip()
+
+
+def render_label_sheet(products, currency=''):
+    """PDF bytes with one label (QR code, name, SKU, price) per product, 24 per A4 page"""
+    from reportlab.graphics import renderPDF
+    from reportlab.graphics.barcode.qr import QrCodeWidget
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
+    font, shaped = _label_font()
+    page_width, page_height = A4
+    label_width, label_height = page_width / LABEL_COLUMNS, page_height / LABEL_ROWS
+    qr_size = label_height - 6 * mm
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    per_page = LABEL_COLUMNS * LABEL_ROWS
+    for index, product in enumerate(products):
+        if index and not index % per_page:
+            pdf.showPage()
+        slot = index % per_page
+        x = (slot % LABEL_COLUMNS) * label_width
+        y = page_height - (slot // LABEL_COLUMNS + 1) * label_height
+
+        if product.sku:
+            drawing = Drawing(qr_size, qr_size)
+            drawing.add(QrCodeWidget(product.sku, barLevel='M', barWidth=qr_size, barHeight=qr_size))
+            renderPDF.draw(drawing, pdf, x + 3 * mm, y + 3 * mm)
+
+        text_x = x + qr_size + 6 * mm
+        text_width = label_width - qr_size - 9 * mm
+        pdf.setFont(font, 9)
+        name = product.name or ''
+        while name and pdf.stringWidth(_label_text(name, shaped), font, 9) > text_width:
+            name = name[:-1]
+        pdf.drawString(text_x, y + label_height - 10 * mm, _label_text(name, shaped))
+        pdf.setFont('Helvetica', 7)
+        pdf.drawString(text_x, y + label_height - 16 * mm, product.sku or '')
+        pdf.setFont('Helvetica-Bold', 11)
+        pdf.drawString(text_x, y + 6 * mm, f'{product.price:.2f} {currency}'.strip())
+    pdf.save()
+    return buffer.getvalue()
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+# Fields returned to the POS scanner; stock_qty is always read fresh because
+# stock moves through bulk UPDATEs that never reach the invalidation signals
+LOOKUP_FIELDS = ('id', 'name', 'sku', 'barcode', 'price', 'unit', 'archived')
+
+
+def _cache():
+    return caches[getattr(settings, 'PRODUCT_LOOKUP_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    # Bounds staleness in other processes, which never see this one's invalidations
+    return getattr(settings, 'PRODUCT_LOOKUP_CACHE_TIMEOUT', 30)
+
+
+def _version_key(company_id):
+    return f'product-lookup-version:{company_id}'
+
+
+def _key(company_id, version, code):
+    return f'product-lookup:{company_id}:{version}:{code}'
+
+
+def _version(company_id):
+    return _cache().get_or_set(_version_key(company_id), 1, None)
+
+
+def invalidate_company_lookups(company_id):
+    """Drop every cached code of the company by moving it to a new key version"""
+    try:
+        _cache().incr(_version_key(company_id))
+    except ValueError:
+        # Never looked up (or evicted): nothing cached under the current version
+        pass
+
+
+def invalidate_product_lookup(sender, instance, **kwargs):
+    """post_save/post_delete handler for Product"""
+    invalidate_company_lookups(instance.company_id)
+
+
+def lookup_product(company_id, code):
+    """Resolve a scanned ``code`` (SKU first, then barcode) to the scanner payload, or None"""
+    from .models import Product
+
+    code = (code or '').strip()
+    if not code:
+        return None
+    key = _key(company_id, _version(company_id), code)
+    payload = _cache().get(key)
+    if payload is not None:
+        stock_qty = Product.objects.filter(pk=payload['id']).values_list('stock_qty', flat=True).first()
+        if stock_qty is not None:
+            return {**payload, 'stock_qty': stock_qty}
+
+    rows = list(
+        Product.objects.filter(Q(sku=code) | Q(barcode=code), company_id=company_id)
+        .values(*LOOKUP_FIELDS, 'stock_qty')[:2]
+    )
+    if not rows:
+        return None
+    row = next((row for row in rows if row['sku'] == code), rows[0])
+    stock_qty = row.pop('stock_qty')
+    row['price'] = str(row['price'])
+    _cache().set(key, row, _timeout())
+    return {**row, 'stock_qty': stock_qty}
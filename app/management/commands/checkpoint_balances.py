@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from app.balances import checkpoint_company_balances
+from app.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Write monthly customer balance checkpoints (run at the start of each month)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', action='append', default=[], help='Company code (repeatable, default: all)')
+        parser.add_argument('--until', type=str, default=None, help='Last period to write, YYYY-MM-DD (default: current month)')
+
+    def handle(self, *args, **options):
+        until = None
+        if options['until']:
+            until = parse_date(options['until'])
+            if until is None:
+                raise CommandError('--until must be a date in YYYY-MM-DD format')
+
+        companies = Company.objects.order_by('id')
+        if options['company']:
+            companies = companies.filter(code__in=options['company'])
+
+        total = 0
+        for company in companies:
+            written = checkpoint_company_balances(company.id, until=until)
+            if written:
+                self.stdout.write(f'{company.code}: {written} period(s) written')
+            total += written
+        self.stdout.write(self.style.SUCCESS(f'Checkpoints written for {total} period(s)'))
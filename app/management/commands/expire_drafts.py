@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from app.invoicing import expire_company_drafts
+from app.models import Company, CompanyProfile
+
+
+class Command(BaseCommand):
+    help = 'Delete draft invoices older than each company\'s draft TTL (CompanyProfile.draft_ttl_days)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', action='append', default=[], help='Company code (repeatable, default: all)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Drafts removed per transaction')
+        parser.add_argument('--cancel', action='store_true', help='Mark stale drafts as cancelled instead of deleting them')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.order_by('id')
+        if options['company']:
+            companies = companies.filter(code__in=options['company'])
+        default_ttl = CompanyProfile._meta.get_field('draft_ttl_days').default
+
+        total = 0
+        for company_id, ttl_days in companies.values_list('id', 'profile__draft_ttl_days'):
+            ttl_days = default_ttl if ttl_days is None else ttl_days
+            if not ttl_days:
+                continue
+            total += expire_company_drafts(company_id, ttl_days, options['batch_size'], options['cancel'])
+        action = 'cancelled' if options['cancel'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'Stale drafts {action}: {total}'))
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.labels import QR_BATCH_SIZE, generate_qr_codes, render_label_sheet
+from app.models import Company, CompanyProfile, Product
+
+
+class Command(BaseCommand):
+    help = 'Generate missing product QR images (Product.qr_code) and, optionally, a printable label sheet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', action='append', default=[], help='Company code (repeatable, default: all)')
+        parser.add_argument('--batch-size', type=int, default=QR_BATCH_SIZE, help='Products rendered per worker task')
+        parser.add_argument('--workers', type=int, default=None, help='Rendering processes (default: CPU count, 1 disables the pool)')
+        parser.add_argument('--labels', metavar='PDF', help='Also write a label sheet of the selected products to this file')
+        parser.add_argument('--sku', action='append', default=[], help='Limit the label sheet to these SKUs (repeatable)')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.order_by('id')
+        if options['company']:
+            companies = companies.filter(code__in=options['company'])
+        products = Product.objects.filter(company__in=companies)
+        currencies = set(CompanyProfile.objects.filter(company__in=companies).values_list('primary_currency', flat=True))
+        if options['labels'] and len(currencies) > 1:
+            raise CommandError('Label sheets take one currency; pass a single --company')
+
+        generated = generate_qr_codes(products, options['batch_size'], options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'QR images generated: {generated}'))
+
+        if options['labels']:
+            selection = products.filter(archived=False)
+            if options['sku']:
+                selection = selection.filter(sku__in=options['sku'])
+            pdf = render_label_sheet(
+                selection.only('name', 'sku', 'price').order_by('company_id', 'name').iterator(),
+                currencies.pop() if currencies else '',
+            )
+            Path(options['labels']).write_bytes(pdf)
+            self.stdout.write(self.style.SUCCESS(f"Label sheet written: {options['labels']}"))
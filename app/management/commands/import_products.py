@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.imports import IMPORT_BATCH_SIZE, ImportFormatError, import_products
+from app.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Bulk import products from a CSV or XLSX sheet into one company'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file (header row: name, price, category, ...)')
+        parser.add_argument('--company', required=True, help='Company code')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'xlsx'], help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Rows inserted per transaction')
+        parser.add_argument('--create-categories', action='store_true', help='Create categories that do not exist yet')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without creating products')
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(code=options['company']).first()
+        if company is None:
+            raise CommandError(f"Unknown company code: {options['company']}")
+        file_format = options['file_format'] or ('xlsx' if options['path'].lower().endswith('.xlsx') else 'csv')
+
+        try:
+            with open(options['path'], 'rb') as file:
+                report = import_products(
+                    company, file, file_format, batch_size=options['batch_size'],
+                    create_categories=options['create_categories'], dry_run=options['dry_run'],
+                )
+        except ImportFormatError as exc:
+            # Raised mid-file for encoding/CSV errors, after earlier batches were committed
+            raise CommandError(f'{exc.code} {json.dumps(exc.extra, ensure_ascii=False) if exc.extra else ""}'.strip())
+        except OSError as exc:
+            raise CommandError(f"Cannot read {options['path']}: {exc}")
+
+        for error in report['errors']:
+            self.stdout.write(f"row {error['row']}: {json.dumps(error['errors'], ensure_ascii=False)}")
+        action = 'valid' if options['dry_run'] else 'imported'
+        self.stdout.write(self.style.SUCCESS(f"Products {action}: {report['created']}, rows rejected: {report['failed']}"))
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from app.balances import rebuild_company_balances
+from app.models import Company
+
+
+def _init_worker():
+    # Workers must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild CustomerBalance rows for all companies from invoices, payments and returns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', action='append', default=[], help='Company code to rebuild (repeatable, default: all)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows, do not write')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.order_by('id')
+        if options['company']:
+            companies = companies.filter(code__in=options['company'])
+        company_ids = list(companies.values_list('id', flat=True))
+        if not company_ids:
+            raise CommandError('No matching companies')
+
+        workers = max(1, min(options['workers'], len(company_ids)))
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite allows a single writer; parallel rebuilds would only contend for the lock
+            self.stdout.write(self.style.WARNING('SQLite database detected, rebuilding in a single process'))
+            workers = 1
+
+        dry_run = options['dry_run']
+        if workers == 1:
+            results = (rebuild_company_balances(company_id, dry_run) for company_id in company_ids)
+            self._report(results, dry_run)
+            return
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            results = pool.map(rebuild_company_balances, company_ids, [dry_run] * len(company_ids))
+            self._report(results, dry_run)
+
+    def _report(self, results, dry_run):
+        created = updated = drifted = 0
+        for result in results:
+            created += result['created']
+            updated += result['updated']
+            drifted += len(result['drifted'])
+            for row in result['drifted']:
+                self.stdout.write(
+                    f"company={result['company_id']} customer={row['customer_id']} "
+                    f"stored={row['stored']} actual={row['actual']}"
+                )
+
+        prefix = '[dry-run] ' if dry_run else ''
+        style = self.style.WARNING if drifted else self.style.SUCCESS
+        self.stdout.write(style(f'{prefix}Balances rebuilt: {created} created, {updated} updated, {drifted} drifted'))
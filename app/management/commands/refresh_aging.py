@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.balances import refresh_company_aging
+from app.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Refresh the receivables aging table (0-30/31-60/61-90/90+ days) per company'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', action='append', default=[], help='Company code (repeatable, default: all)')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.order_by('id')
+        if options['company']:
+            companies = companies.filter(code__in=options['company'])
+
+        total = 0
+        for company in companies:
+            total += refresh_company_aging(company.id)
+        self.stdout.write(self.style.SUCCESS(f'Aging refreshed: {total} customer(s) with open receivables'))
@@ -0,0 +1,54 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_customer_archived_product_archived_companyprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companyprofile',
+            name='dashboard_cards',
+            field=models.JSONField(blank=True, default=list, verbose_name='بطاقات لوحة التحكم'),
+        ),
+        migrations.AddField(
+            model_name='companyprofile',
+            name='language',
+            field=models.CharField(choices=[('ar', 'العربية'), ('en', 'English')], default='ar', max_length=5, verbose_name='لغة الشركة'),
+        ),
+        migrations.AddField(
+            model_name='companyprofile',
+            name='navbar_message',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='رسالة الشريط العلوي'),
+        ),
+        migrations.AddField(
+            model_name='companyprofile',
+            name='price_display_mode',
+            field=models.CharField(choices=[('both', 'كلا العملتين'), ('primary', 'الأساسية فقط (USD)'), ('secondary', 'الثانوية فقط')], default='both', max_length=12, verbose_name='عرض الأسعار'),
+        ),
+        migrations.AddField(
+            model_name='companyprofile',
+            name='primary_currency',
+            field=models.CharField(default='USD', editable=False, max_length=3, verbose_name='العملة الأساسية'),
+        ),
+        migrations.AddField(
+            model_name='companyprofile',
+            name='secondary_currency',
+            field=models.CharField(blank=True, choices=[('SYP', 'الليرة السورية'), ('SAR', 'الريال السعودي'), ('TRY', 'الليرة التركية'), ('AED', 'الدرهم الإماراتي'), ('EUR', 'اليورو'), ('LBP', 'الليرة اللبنانية')], max_length=3, null=True, verbose_name='العملة الثانوية'),
+        ),
+        migrations.AddField(
+            model_name='companyprofile',
+            name='secondary_per_usd',
+            field=models.DecimalField(blank=True, decimal_places=6, help_text='كم تعادل 1 دولار من العملة الثانوية', max_digits=14, null=True, verbose_name='سعر 1 دولار'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='app.customer', verbose_name='العميل'),
+        ),
+    ]
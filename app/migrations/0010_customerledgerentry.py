@@ -0,0 +1,69 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    """Replay existing invoices, payments and approved returns into the ledger"""
+    Invoice = apps.get_model('app', 'Invoice')
+    Payment = apps.get_model('app', 'Payment')
+    Return = apps.get_model('app', 'Return')
+    CustomerLedgerEntry = apps.get_model('app', 'CustomerLedgerEntry')
+
+    events = []
+    for inv in Invoice.objects.filter(status='confirmed').values('id', 'company_id', 'customer_id', 'total_amount', 'created_at'):
+        events.append((inv['customer_id'], inv['created_at'], 'invoice', inv['id'], '', inv['company_id'], inv['total_amount']))
+    for pay in Payment.objects.values('id', 'company_id', 'customer_id', 'amount', 'payment_date'):
+        events.append((pay['customer_id'], pay['payment_date'], 'payment', pay['id'], '', pay['company_id'], -pay['amount']))
+    for ret in Return.objects.filter(status='approved').values('id', 'company_id', 'customer_id', 'total_amount', 'return_number', 'return_date', 'approved_at'):
+        events.append((ret['customer_id'], ret['approved_at'] or ret['return_date'], 'return', ret['id'], ret['return_number'], ret['company_id'], -ret['total_amount']))
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    entries = []
+    balances = {}
+    for customer_id, created_at, entry_type, source_id, reference, company_id, amount in events:
+        balances[customer_id] = balances.get(customer_id, 0) + amount
+        entries.append(CustomerLedgerEntry(
+            company_id=company_id,
+            customer_id=customer_id,
+            entry_type=entry_type,
+            source_id=source_id,
+            reference=reference,
+            amount=amount,
+            balance=balances[customer_id],
+            created_at=created_at,
+        ))
+    CustomerLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_companyprofile_settings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('invoice', 'فاتورة'), ('payment', 'دفعة'), ('return', 'مرتجع'), ('adjustment', 'تسوية')], max_length=16, verbose_name='نوع القيد')),
+                ('source_id', models.BigIntegerField(blank=True, null=True, verbose_name='معرف المستند')),
+                ('reference', models.CharField(blank=True, default='', max_length=100, verbose_name='المرجع')),
+                ('amount', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='المبلغ')),
+                ('balance', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='الرصيد بعد القيد')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='التاريخ')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.company', verbose_name='الشركة')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='app.customer', verbose_name='العميل')),
+            ],
+            options={
+                'verbose_name': 'قيد كشف حساب',
+                'verbose_name_plural': 'قيود كشف الحساب',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['customer', 'created_at', 'id'], name='ledger_customer_time_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
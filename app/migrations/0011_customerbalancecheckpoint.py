@@ -0,0 +1,50 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_customerledgerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(verbose_name='بداية الشهر')),
+                ('balance', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='الرصيد')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+            ],
+            options={
+                'verbose_name': 'لقطة رصيد',
+                'verbose_name_plural': 'لقطات الأرصدة',
+                'ordering': ['-period'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customerledgerentry',
+            index=models.Index(fields=['company', 'created_at'], name='ledger_company_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='customerbalancecheckpoint',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.company', verbose_name='الشركة'),
+        ),
+        migrations.AddField(
+            model_name='customerbalancecheckpoint',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='app.customer', verbose_name='العميل'),
+        ),
+        migrations.AddIndex(
+            model_name='customerbalancecheckpoint',
+            index=models.Index(fields=['company', 'period'], name='checkpoint_company_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='customerbalancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('customer', 'period'), name='unique_customer_checkpoint_period'),
+        ),
+    ]
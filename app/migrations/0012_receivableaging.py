@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_customerbalancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivableAging',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='0-30 يوم')),
+                ('days_31_60', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='31-60 يوم')),
+                ('days_61_90', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='61-90 يوم')),
+                ('days_over_90', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='أكثر من 90 يوم')),
+                ('total', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='الإجمالي')),
+                ('refreshed_at', models.DateTimeField(verbose_name='آخر تحديث')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.company', verbose_name='الشركة')),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='aging', to='app.customer', verbose_name='العميل')),
+            ],
+            options={
+                'verbose_name': 'عمر الذمة',
+                'verbose_name_plural': 'أعمار الذمم',
+                'ordering': ['-total'],
+                'indexes': [models.Index(fields=['company', '-total'], name='aging_company_total_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+def clamp_negative_stock(apps, schema_editor):
+    # Oversold rows would violate the new constraint
+    Product = apps.get_model('app', 'Product')
+    Product.objects.filter(stock_qty__lt=0).update(stock_qty=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_receivableaging'),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_negative_stock, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.CheckConstraint(check=models.Q(('stock_qty__gte', 0)), name='product_stock_qty_non_negative'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:32
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_product_stock_qty_non_negative'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=128, verbose_name='المفتاح')),
+                ('method', models.CharField(max_length=10, verbose_name='الطريقة')),
+                ('path', models.CharField(max_length=255, verbose_name='المسار')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='رمز الحالة')),
+                ('response_body', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='الاستجابة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('expires_at', models.DateTimeField(verbose_name='تاريخ الانتهاء')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='المستخدم')),
+            ],
+            options={
+                'verbose_name': 'مفتاح عدم التكرار',
+                'verbose_name_plural': 'مفاتيح عدم التكرار',
+                'indexes': [models.Index(fields=['expires_at'], name='idempotency_expires_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('user', 'key'), name='unique_user_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:38
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Fold repeated (invoice, product, price) lines into the oldest one before the constraint exists
+    InvoiceItem = apps.get_model('app', 'InvoiceItem')
+    ReturnItem = apps.get_model('app', 'ReturnItem')
+    duplicates = list(
+        InvoiceItem.objects.order_by().values('invoice_id', 'product_id', 'price_at_add')
+        .annotate(keep=Min('id'), total=Sum('qty'), lines=Count('id')).filter(lines__gt=1)
+    )
+    for group in duplicates:
+        others = InvoiceItem.objects.filter(
+            invoice_id=group['invoice_id'], product_id=group['product_id'], price_at_add=group['price_at_add']
+        ).exclude(id=group['keep'])
+        ReturnItem.objects.filter(original_item__in=others).update(original_item_id=group['keep'])
+        others.delete()
+        InvoiceItem.objects.filter(id=group['keep']).update(qty=group['total'])
+
+
+class Migration(migrations.Migration):
+    # The merge commits before the constraint is added (PostgreSQL refuses ALTER TABLE with pending FK checks)
+    atomic = False
+
+    dependencies = [
+        ('app', '0014_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='invoiceitem',
+            constraint=models.UniqueConstraint(fields=('invoice', 'product', 'price_at_add'), name='unique_invoice_product_price'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_invoiceitem_unique_product_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companyprofile',
+            name='draft_ttl_days',
+            field=models.PositiveIntegerField(default=30, help_text='تحذف المسودات غير المؤكدة بعد هذه المدة، 0 لتعطيل الحذف', verbose_name='مدة صلاحية المسودات (أيام)'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['company', 'status', 'created_at'], name='invoice_company_status_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seed_return_sequences(apps, schema_editor):
+    """Start each company's return counter after its highest existing RET-<code>-<n> number"""
+    Return = apps.get_model('app', 'Return')
+    DocumentSequence = apps.get_model('app', 'DocumentSequence')
+
+    last_values = {}
+    for company_id, return_number in Return.objects.values_list('company_id', 'return_number').iterator():
+        try:
+            number = int(return_number.rsplit('-', 1)[-1])
+        except (AttributeError, ValueError):
+            continue
+        last_values[company_id] = max(last_values.get(company_id, 0), number)
+    DocumentSequence.objects.bulk_create([
+        DocumentSequence(company_id=company_id, key='return', last_value=last_value)
+        for company_id, last_value in last_values.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_companyprofile_draft_ttl_days'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, verbose_name='نوع المستند')),
+                ('last_value', models.PositiveBigIntegerField(default=0, verbose_name='آخر رقم')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences', to='app.company', verbose_name='الشركة')),
+            ],
+            options={
+                'verbose_name': 'عداد ترقيم',
+                'verbose_name_plural': 'عدادات الترقيم',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentsequence',
+            constraint=models.UniqueConstraint(fields=('company', 'key'), name='unique_company_sequence_key'),
+        ),
+        migrations.RunPython(seed_return_sequences, migrations.RunPython.noop),
+    ]
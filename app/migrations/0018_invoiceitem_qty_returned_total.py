@@ -0,0 +1,38 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:41
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_returned_totals(apps, schema_editor):
+    """Sum approved returns per invoice line; past over-returns are capped at the sold quantity"""
+    InvoiceItem = apps.get_model('app', 'InvoiceItem')
+    ReturnItem = apps.get_model('app', 'ReturnItem')
+    returned = dict(
+        ReturnItem.objects.filter(return_obj__status__in=['approved', 'completed']).order_by()
+        .values('original_item_id').annotate(total=Sum('qty_returned')).values_list('original_item_id', 'total')
+    )
+    items = list(InvoiceItem.objects.filter(id__in=list(returned)))
+    for item in items:
+        item.qty_returned_total = min(returned[item.id], item.qty)
+    InvoiceItem.objects.bulk_update(items, ['qty_returned_total'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_documentsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='qty_returned_total',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=12, verbose_name='الكمية المرتجعة (معتمدة)'),
+        ),
+        migrations.RunPython(backfill_returned_totals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='invoiceitem',
+            constraint=models.CheckConstraint(check=models.Q(('qty_returned_total__lte', models.F('qty'))), name='invoiceitem_returned_within_sold'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:43
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_skus(apps, schema_editor):
+    """Blank SKUs become NULL; repeated ones keep the oldest product and suffix the others with their id"""
+    Product = apps.get_model('app', 'Product')
+    Product.objects.filter(sku='').update(sku=None)
+    duplicates = list(
+        Product.objects.exclude(sku=None).order_by().values('company_id', 'sku')
+        .annotate(n=Count('id')).filter(n__gt=1).values_list('company_id', 'sku')
+    )
+    for company_id, sku in duplicates:
+        products = list(Product.objects.filter(company_id=company_id, sku=sku).order_by('id')[1:])
+        for product in products:
+            suffix = f'-{product.id}'
+            product.sku = sku[:64 - len(suffix)] + suffix
+        Product.objects.bulk_update(products, ['sku'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_invoiceitem_qty_returned_total'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_skus, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('company', 'sku'), name='unique_company_sku'),
+        ),
+    ]
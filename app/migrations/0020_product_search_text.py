@@ -0,0 +1,55 @@
+# Generated by Django 5.0.7 on 2026-10-17 04:45
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of app.search's normalization as of this migration; later changes
+# there (new fields, new folding rules) must not alter or break the backfill
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_NON_WORD = re.compile(r'[^\w]+')
+_LETTER_VARIANTS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    'ـ': None,
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},
+})
+
+
+def _search_text(product):
+    text = ' '.join(filter(None, [product.name, product.sku, product.description]))
+    text = _DIACRITICS.sub('', text.lower()).translate(_LETTER_VARIANTS)
+    tokens = _NON_WORD.sub(' ', text).strip().split()
+    return ' '.join(tokens + [token[2:] for token in tokens if token.startswith('ال') and len(token) > 4])
+
+
+def backfill_search_text(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    batch = []
+    for product in Product.objects.only('id', 'name', 'sku', 'description').iterator(chunk_size=2000):
+        product.search_text = _search_text(product)
+        batch.append(product)
+        if len(batch) == 2000:
+            Product.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    Product.objects.bulk_update(batch, ['search_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_product_unique_company_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='نص البحث'),
+        ),
+        # The FTS5 / trigram index itself is (re)created by app.search.ensure_search_index after migrate
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,13 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password
+from django.core.serializers.json import DjangoJSONEncoder
 import uuid
+from collections import defaultdict
+
+from .search import product_search_text
 
 class Company(models.Model):
     name = models.CharField(max_length=256, verbose_name='اسم الشركة')
@@ -47,6 +52,7 @@ class CompanyProfile(models.Model):
         ('primary', 'الأساسية فقط (USD)'),
         ('secondary', 'الثانوية فقط')
     ], default='both', verbose_name='عرض الأسعار')
+    draft_ttl_days = models.PositiveIntegerField(default=30, help_text='تحذف المسودات غير المؤكدة بعد هذه المدة، 0 لتعطيل الحذف', verbose_name='مدة صلاحية المسودات (أيام)')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='تاريخ التحديث')
 
@@ -166,6 +172,7 @@ class Product(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='products', verbose_name='الشركة')
     name = models.CharField(max_length=256, verbose_name='اسم المنتج')
     sku = models.CharField(max_length=64, blank=True, null=True, verbose_name='رمز المنتج')
+    barcode = models.CharField(max_length=64, blank=True, null=True, verbose_name='الباركود')
     category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name='products', verbose_name='الفئة')
     price = models.DecimalField(max_digits=12, decimal_places=4, verbose_name='السعر')
     stock_qty = models.IntegerField(default=0, verbose_name='الكمية في المخزون')
@@ -176,6 +183,7 @@ class Product(models.Model):
     measurement = models.CharField(max_length=100, blank=True, null=True, help_text='القياس (اختياري)', verbose_name='القياس')
     description = models.TextField(blank=True, null=True, help_text='وصف المنتج (اختياري)', verbose_name='الوصف')
     archived = models.BooleanField(default=False, verbose_name='مؤرشف')
+    search_text = models.TextField(blank=True, default='', editable=False, verbose_name='نص البحث')
     
     # Advanced pricing fields
     cost_price = models.DecimalField(max_digits=12, decimal_places=4, blank=True, null=True, help_text='سعر التكلفة', verbose_name='سعر التكلفة')
@@ -183,11 +191,16 @@ class Product(models.Model):
     retail_price = models.DecimalField(max_digits=12, decimal_places=4, blank=True, null=True, help_text='سعر البيع بالمفرق', verbose_name='سعر البيع بالمفرق')
     
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
-    
-    def generate_sku(self):
-        """Generate a unique SKU for the product within the company"""
-        import uuid
-        import time
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(stock_qty__gte=0), name='product_stock_qty_non_negative'),
+            models.UniqueConstraint(fields=['company', 'sku'], name='unique_company_sku'),
+            models.UniqueConstraint(fields=['company', 'barcode'], name='unique_company_barcode'),
+        ]
+    
+    def generate_sku(self, number=None):
+        """Build a SKU from the company/name prefixes and a number of the company's ``sku`` sequence"""
         import re
         
         # Create a base SKU from product name - English letters only
@@ -203,20 +216,51 @@ class Product(models.Model):
         if not company_prefix:
             company_prefix = "CMP"
         
-        timestamp = str(int(time.time()))[-4:]  # Last 4 digits of timestamp
-        unique_id = str(uuid.uuid4())[:3].upper()
-        
-        return f"{company_prefix}{base_name}{timestamp}{unique_id}"
+        if number is None:
+            number = DocumentSequence.allocate(self.company_id, DocumentSequence.SKU)
+        return f"{company_prefix}{base_name}{number:06d}"
+    
+    @classmethod
+    def assign_skus(cls, products):
+        """Give every product without a SKU the next code of its company's sequence.
+
+        Numbers are reserved as one block per company, so bulk creation needs a
+        single counter update instead of a uniqueness probe per product.
+        """
+        pending = defaultdict(list)
+        for product in products:
+            if not product.sku:
+                pending[product.company_id].append(product)
+        for company_id, company_products in pending.items():
+            first = DocumentSequence.allocate(company_id, DocumentSequence.SKU, len(company_products))
+            for offset, product in enumerate(company_products):
+                product.sku = product.generate_sku(first + offset)
+        return products
     
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'sku', 'barcode', 'description'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
+        # Products without a barcode must not collide on the unique (company, barcode) index
+        self.barcode = (self.barcode or '').strip() or None
         # Generate SKU if not provided
-        if not self.sku:
+        if self.sku:
+            self.search_text = product_search_text(self)
+            super().save(*args, **kwargs)
+            return
+        for _ in range(5):
             self.sku = self.generate_sku()
-            # Ensure uniqueness within the company
-            while Product.objects.filter(company=self.company, sku=self.sku).exclude(pk=self.pk).exists():
-                self.sku = self.generate_sku()
-        
-        super().save(*args, **kwargs)
+            self.search_text = product_search_text(self)
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                # Only a hand-entered SKU can already hold a sequence code; retry with the next number
+                if not Product.objects.filter(company_id=self.company_id, sku=self.sku).exclude(pk=self.pk).exists():
+                    self.sku = None
+                    raise
+        raise IntegrityError('sku_allocation_failed')
     
     def __str__(self): 
         unit_display = f" - {self.get_unit_display()}" if self.unit else ""
@@ -237,6 +281,10 @@ class Invoice(models.Model):
         verbose_name = 'فاتورة'
         verbose_name_plural = 'الفواتير'
         ordering = ['-created_at']
+        indexes = [
+            # Serves the draft expiry sweep and the per-status dashboard counts
+            models.Index(fields=['company', 'status', 'created_at'], name='invoice_company_status_idx'),
+        ]
     
     def __str__(self):
         return f"فاتورة #{self.id} - {self.customer.name} ({self.company.name})"
@@ -246,12 +294,18 @@ class InvoiceItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT, verbose_name='المنتج')
     qty = models.DecimalField(max_digits=12, decimal_places=4, verbose_name='الكمية')
     price_at_add = models.DecimalField(max_digits=12, decimal_places=4, verbose_name='السعر عند الإضافة')
+    qty_returned_total = models.DecimalField(max_digits=12, decimal_places=4, default=0, verbose_name='الكمية المرتجعة (معتمدة)')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
     
     class Meta:
         verbose_name = 'عنصر الفاتورة'
         verbose_name_plural = 'عناصر الفاتورة'
         ordering = ['-created_at']
+        constraints = [
+            # Repeated adds of a product at the same price grow one line
+            models.UniqueConstraint(fields=['invoice', 'product', 'price_at_add'], name='unique_invoice_product_price'),
+            models.CheckConstraint(check=models.Q(qty_returned_total__lte=F('qty')), name='invoiceitem_returned_within_sold'),
+        ]
     
     @property
     def line_total(self): 
@@ -300,16 +354,7 @@ class Return(models.Model):
     def save(self, *args, **kwargs):
         if not self.return_number:
             # إنشاء رقم مرتجع تلقائي
-            last_return = Return.objects.filter(company=self.company).order_by('-id').first()
-            if last_return and last_return.return_number:
-                try:
-                    last_num = int(last_return.return_number.split('-')[-1])
-                    new_num = last_num + 1
-                except (ValueError, IndexError):
-                    new_num = 1
-            else:
-                new_num = 1
-            
+            new_num = DocumentSequence.allocate(self.company_id, DocumentSequence.RETURN)
             self.return_number = f"RET-{self.company.code}-{new_num:04d}"
         
         super().save(*args, **kwargs)
@@ -339,7 +384,7 @@ class ReturnItem(models.Model):
         super().save(*args, **kwargs)
         
         # تحديث المجموع الإجمالي للمرتجع
-        self.return_obj.total_amount = sum(item.line_total for item in self.return_obj.items.all())
+        self.return_obj.total_amount = self.return_obj.items.aggregate(total=models.Sum('line_total'))['total'] or 0
         self.return_obj.save(update_fields=['total_amount'])
 
 
@@ -479,4 +524,151 @@ class CustomerBalance(models.Model):
         """حساب الرصيد"""
         self.balance = self.total_invoiced - self.total_paid - self.total_returns
         self.save()
-        return self.balance
\ No newline at end of file
+        return self.balance
+
+class CustomerLedgerEntry(models.Model):
+    """قيد في كشف حساب العميل (سجل إلحاقي فقط)"""
+    INVOICE, PAYMENT, RETURN, ADJUSTMENT = 'invoice', 'payment', 'return', 'adjustment'
+    ENTRY_TYPES = [
+        (INVOICE, 'فاتورة'),
+        (PAYMENT, 'دفعة'),
+        (RETURN, 'مرتجع'),
+        (ADJUSTMENT, 'تسوية'),
+    ]
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, verbose_name='الشركة')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='ledger_entries', verbose_name='العميل')
+    entry_type = models.CharField(max_length=16, choices=ENTRY_TYPES, verbose_name='نوع القيد')
+    source_id = models.BigIntegerField(blank=True, null=True, verbose_name='معرف المستند')
+    reference = models.CharField(max_length=100, blank=True, default='', verbose_name='المرجع')
+    amount = models.DecimalField(max_digits=14, decimal_places=4, verbose_name='المبلغ')
+    balance = models.DecimalField(max_digits=14, decimal_places=4, verbose_name='الرصيد بعد القيد')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='التاريخ')
+
+    class Meta:
+        verbose_name = 'قيد كشف حساب'
+        verbose_name_plural = 'قيود كشف الحساب'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['customer', 'created_at', 'id'], name='ledger_customer_time_idx'),
+            models.Index(fields=['company', 'created_at'], name='ledger_company_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_entry_type_display()} {self.amount} $ - {self.customer.name}"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Ledger entries are append-only')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ledger entries are append-only')
+
+
+class CustomerBalanceCheckpoint(models.Model):
+    """لقطة شهرية لرصيد العميل (الرصيد في بداية الشهر)"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, verbose_name='الشركة')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='balance_checkpoints', verbose_name='العميل')
+    period = models.DateField(verbose_name='بداية الشهر')
+    balance = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name='الرصيد')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
+
+    class Meta:
+        verbose_name = 'لقطة رصيد'
+        verbose_name_plural = 'لقطات الأرصدة'
+        ordering = ['-period']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'period'], name='unique_customer_checkpoint_period'),
+        ]
+        indexes = [
+            models.Index(fields=['company', 'period'], name='checkpoint_company_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer.name} - {self.period:%Y-%m} - {self.balance} $"
+
+
+class ReceivableAging(models.Model):
+    """أعمار الذمم المدينة للعميل (تُحدّث دورياً)"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, verbose_name='الشركة')
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, related_name='aging', verbose_name='العميل')
+    current = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name='0-30 يوم')
+    days_31_60 = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name='31-60 يوم')
+    days_61_90 = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name='61-90 يوم')
+    days_over_90 = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name='أكثر من 90 يوم')
+    total = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name='الإجمالي')
+    refreshed_at = models.DateTimeField(verbose_name='آخر تحديث')
+
+    class Meta:
+        verbose_name = 'عمر الذمة'
+        verbose_name_plural = 'أعمار الذمم'
+        ordering = ['-total']
+        indexes = [
+            models.Index(fields=['company', '-total'], name='aging_company_total_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer.name} - {self.total} $"
+
+
+class IdempotencyKey(models.Model):
+    """مفتاح عدم التكرار: يحفظ استجابة الطلب لإعادتها عند إعادة الإرسال"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys', verbose_name='المستخدم')
+    key = models.CharField(max_length=128, verbose_name='المفتاح')
+    method = models.CharField(max_length=10, verbose_name='الطريقة')
+    path = models.CharField(max_length=255, verbose_name='المسار')
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='رمز الحالة')
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder, verbose_name='الاستجابة')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
+    expires_at = models.DateTimeField(verbose_name='تاريخ الانتهاء')
+
+    class Meta:
+        verbose_name = 'مفتاح عدم التكرار'
+        verbose_name_plural = 'مفاتيح عدم التكرار'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_user_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.method} {self.path})"
+
+
+class DocumentSequence(models.Model):
+    """عداد ترقيم المستندات لكل شركة (المرتجعات، ...)"""
+    RETURN = 'return'
+    SKU = 'sku'
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='sequences', verbose_name='الشركة')
+    key = models.CharField(max_length=32, verbose_name='نوع المستند')
+    last_value = models.PositiveBigIntegerField(default=0, verbose_name='آخر رقم')
+
+    class Meta:
+        verbose_name = 'عداد ترقيم'
+        verbose_name_plural = 'عدادات الترقيم'
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'key'], name='unique_company_sequence_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}: {self.last_value}"
+
+    @classmethod
+    def allocate(cls, company_id, key, count=1):
+        """Reserve ``count`` consecutive numbers of a company's sequence and return the first"""
+        with transaction.atomic():
+            # The UPDATE holds the counter's row lock until the caller's transaction ends
+            counter = cls.objects.filter(company_id=company_id, key=key)
+            if not counter.update(last_value=F('last_value') + count):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(company_id=company_id, key=key, last_value=count)
+                    return 1
+                except IntegrityError:
+                    # Created concurrently
+                    counter.update(last_value=F('last_value') + count)
+            return counter.values_list('last_value', flat=True).get() - count + 1
+
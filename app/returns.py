@@ -0,0 +1,161 @@
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Sum, When
+from django.db.models.functions import Coalesce
+
+from .balances import post_company_entries
+from .models import Company, CustomerLedgerEntry, InvoiceItem, Return, ReturnItem
+from .stock import increment_stock
+
+
+class ReturnExceedsSold(Exception):
+    """Raised when a line would return more than was sold on the invoice"""
+
+    def __init__(self, item_id, original_qty, already_returned=0):
+        super().__init__('qty_returned_exceeds_sold')
+        self.item_id = item_id
+        self.original_qty = original_qty
+        self.already_returned = already_returned
+
+
+def parse_return_lines(items):
+    """Normalize ``[{original_item_id, qty_returned}, ...]`` into ``{item_id: qty}``, raising ValueError on bad input"""
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    lines = defaultdict(Decimal)
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('each item must be an object')
+        try:
+            item_id = int(item.get('original_item_id') or item.get('original_item'))
+            qty = Decimal(str(item.get('qty_returned') or item.get('qty')))
+        except (TypeError, ValueError, InvalidOperation):
+            raise ValueError('invalid original_item_id or qty_returned')
+        if qty <= 0:
+            raise ValueError('qty_returned must be positive')
+        lines[item_id] += qty
+    return dict(lines)
+
+
+def create_return(invoice, lines, user, notes=''):
+    """Create a pending return of ``{invoice_item_id: qty}`` lines of ``invoice``; must run in a transaction"""
+    items = invoice.items.filter(id__in=lines).in_bulk()
+    for item_id, qty in lines.items():
+        if item_id not in items:
+            raise InvoiceItem.DoesNotExist(f'invoice_item_not_found:{item_id}')
+        if qty + items[item_id].qty_returned_total > items[item_id].qty:
+            raise ReturnExceedsSold(item_id, items[item_id].qty, items[item_id].qty_returned_total)
+
+    return_items = [
+        ReturnItem(
+            original_item=items[item_id],
+            product_id=items[item_id].product_id,
+            qty_returned=qty,
+            unit_price=items[item_id].price_at_add,
+            line_total=qty * items[item_id].price_at_add,
+        )
+        for item_id, qty in lines.items()
+    ]
+    return_obj = Return.objects.create(
+        company=invoice.company,
+        original_invoice=invoice,
+        customer=invoice.customer,
+        notes=notes,
+        created_by=user,
+        total_amount=sum(item.line_total for item in return_items),
+    )
+    for item in return_items:
+        item.return_obj = return_obj
+    ReturnItem.objects.bulk_create(return_items)
+    return return_obj
+
+
+def returned_quantities(return_ids):
+    """``{invoice_item_id: qty}`` of the given returns"""
+    return dict(
+        ReturnItem.objects.filter(return_obj_id__in=return_ids).order_by()
+        .values('original_item_id').annotate(total=Sum('qty_returned')).values_list('original_item_id', 'total')
+    )
+
+
+def record_returned_quantities(quantities, sign=1):
+    """Add (or with ``sign=-1`` remove) ``{invoice_item_id: qty}`` to the lines' ``qty_returned_total``"""
+    if not quantities:
+        return
+    try:
+        with transaction.atomic():
+            InvoiceItem.objects.filter(id__in=list(quantities)).update(qty_returned_total=Case(
+                *[When(id=item_id, then=F('qty_returned_total') + sign * qty) for item_id, qty in quantities.items()],
+                output_field=DecimalField(max_digits=12, decimal_places=4),
+            ))
+    except IntegrityError:
+        # invoiceitem_returned_within_sold: several pending returns overlapped on a line
+        over = (
+            InvoiceItem.objects.filter(id__in=list(quantities)).values_list('id', 'qty', 'qty_returned_total')
+        )
+        for item_id, qty, already in over:
+            if already + sign * quantities[item_id] > qty:
+                raise ReturnExceedsSold(item_id, qty, already)
+        raise
+
+
+def approve_returns(return_ids, user):
+    """Approve many pending returns in order, restocking them; returns ``(approved_ids, {id: failure})``"""
+    with transaction.atomic():
+        pending = Return.objects.select_for_update().filter(pk__in=return_ids, status='pending').in_bulk()
+        failures = {pk: {'code': 'not_pending'} for pk in return_ids if pk not in pending}
+
+        lines = defaultdict(list)
+        rows = (
+            ReturnItem.objects.filter(return_obj_id__in=list(pending)).order_by()
+            .values('return_obj_id', 'original_item_id', 'product_id').annotate(total=Sum('qty_returned'))
+            .values_list('return_obj_id', 'original_item_id', 'product_id', 'total')
+        )
+        for return_id, item_id, product_id, qty in rows:
+            lines[return_id].append((item_id, product_id, qty))
+        room = {
+            item_id: qty - returned
+            for item_id, qty, returned in InvoiceItem.objects.select_for_update()
+            .filter(id__in={item_id for return_lines in lines.values() for item_id, _, _ in return_lines})
+            .order_by('id').values_list('id', 'qty', 'qty_returned_total')
+        }
+
+        approved, item_quantities, product_quantities = [], defaultdict(Decimal), defaultdict(Decimal)
+        for pk in return_ids:
+            if pk in failures or pk in approved:
+                continue
+            needed = defaultdict(Decimal)
+            for item_id, _, qty in lines[pk]:
+                needed[item_id] += qty
+            over = next((item_id for item_id, qty in needed.items() if qty > room[item_id]), None)
+            if over is not None:
+                failures[pk] = {'code': 'qty_returned_exceeds_sold', 'original_item': over}
+                continue
+            for item_id, qty in needed.items():
+                room[item_id] -= qty
+                item_quantities[item_id] += qty
+            for _, product_id, qty in lines[pk]:
+                product_quantities[product_id] += qty
+            approved.append(pk)
+
+        record_returned_quantities(item_quantities)
+        increment_stock(product_quantities)
+        Return.objects.filter(pk__in=approved).update(
+            status='approved', approved_by=user, approved_at=Coalesce(F('approved_at'), F('return_date')),
+        )
+        entries = defaultdict(list)
+        for pk in approved:
+            return_obj = pending[pk]
+            entries[return_obj.company_id].append({
+                'customer_id': return_obj.customer_id,
+                'entry_type': CustomerLedgerEntry.RETURN,
+                'source_id': return_obj.id,
+                'reference': return_obj.return_number,
+                'returns': return_obj.total_amount,
+            })
+        companies = Company.objects.in_bulk(list(entries))
+        for company_id, company_entries in entries.items():
+            post_company_entries(companies[company_id], company_entries)
+    return approved, failures
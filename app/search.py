@@ -0,0 +1,162 @@
+import re
+
+from django.db import DatabaseError, connection, connections
+from django.db.models import Case, IntegerField, Q, When
+from django.db.models.expressions import RawSQL
+
+# Matches of a search listing ordered by relevance; the rest follow by name
+SEARCH_RANKED_ROWS = 200
+# Products returned by the search-as-you-type suggestions
+SUGGEST_LIMIT = 20
+# Above this many matches a suggestion query is too broad to rank usefully (and ranking gets slow)
+SUGGEST_RANK_LIMIT = 2000
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_NON_WORD = re.compile(r'[^\w]+')
+_LETTER_VARIANTS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    'ـ': None,  # tatweel
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Persian digits
+})
+
+
+def normalize_arabic(text):
+    """Fold Arabic spelling variants so that e.g. "أحمد"/"احمد" and "مدرسة"/"مدرسه" match"""
+    text = _DIACRITICS.sub('', (text or '').lower()).translate(_LETTER_VARIANTS)
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def _article_variants(tokens):
+    # "النور" is also indexed as "نور" so that searching without the article matches
+    return [token[2:] for token in tokens if token.startswith('ال') and len(token) > 4]
+
+
+def product_search_text(product):
+    """Normalized text indexed for a product (name, SKU, barcode and description)"""
+    fields = [product.name, product.sku, product.barcode, product.description]
+    tokens = normalize_arabic(' '.join(filter(None, fields))).split()
+    return ' '.join(tokens + _article_variants(tokens))
+
+
+_SQLITE_INDEX = [
+    # External-content FTS5 table over app_product.search_text; company_id is stored to scope matches
+    """CREATE VIRTUAL TABLE IF NOT EXISTS app_product_fts USING fts5(
+        search_text, company_id UNINDEXED, content='app_product', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS app_product_fts_ai AFTER INSERT ON app_product BEGIN
+        INSERT INTO app_product_fts(rowid, search_text, company_id) VALUES (new.id, new.search_text, new.company_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS app_product_fts_ad AFTER DELETE ON app_product BEGIN
+        INSERT INTO app_product_fts(app_product_fts, rowid, search_text, company_id)
+        VALUES ('delete', old.id, old.search_text, old.company_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS app_product_fts_au AFTER UPDATE OF search_text, company_id ON app_product BEGIN
+        INSERT INTO app_product_fts(app_product_fts, rowid, search_text, company_id)
+        VALUES ('delete', old.id, old.search_text, old.company_id);
+        INSERT INTO app_product_fts(rowid, search_text, company_id) VALUES (new.id, new.search_text, new.company_id);
+    END""",
+]
+_SQLITE_TRIGGERS = ('app_product_fts_ai', 'app_product_fts_ad', 'app_product_fts_au')
+
+_POSTGRES_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS app_product_search_trgm ON app_product USING gin (search_text gin_trgm_ops)',
+]
+
+
+def ensure_search_index(using=None, **kwargs):
+    """Create the backend's product search index if it is missing (post_migrate handler)"""
+    conn = connections[using or 'default']
+    with conn.cursor() as cursor:
+        if 'app_product' not in conn.introspection.table_names(cursor):
+            return
+        if 'search_text' not in {column.name for column in conn.introspection.get_table_description(cursor, 'app_product')}:
+            # Migrated back before the column existed
+            return
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)", _SQLITE_TRIGGERS
+            )
+            complete = cursor.fetchone()[0] == len(_SQLITE_TRIGGERS)
+            for statement in _SQLITE_INDEX:
+                cursor.execute(statement)
+            if not complete:
+                cursor.execute("INSERT INTO app_product_fts(app_product_fts) VALUES ('rebuild')")
+        elif conn.vendor == 'postgresql':
+            for statement in _POSTGRES_INDEX:
+                cursor.execute(statement)
+
+
+def _fts_query(terms):
+    # Every term must match, the last one as a prefix for search-as-you-type
+    return ' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+def search_products(queryset, query, company_id=None):
+    """Filter a Product queryset by ``query``, keeping every match, and order it by relevance"""
+    terms = normalize_arabic(query).split()
+    if not terms:
+        return queryset
+    if connection.vendor == 'sqlite':
+        match = _fts_query(terms)
+        sql = 'SELECT rowid FROM app_product_fts WHERE app_product_fts MATCH %s'
+        params = [match]
+        if company_id is not None:
+            sql += ' AND company_id = %s'
+            params.append(company_id)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'{sql} ORDER BY rank LIMIT {SEARCH_RANKED_ROWS}', params)
+                ranked = [row[0] for row in cursor.fetchall()]
+        except DatabaseError:
+            ranked = None
+        if ranked is not None:
+            # An IN subquery rather than a join: SQLite would otherwise count
+            # matches by re-running the MATCH once per product of the company
+            queryset = queryset.filter(pk__in=RawSQL(sql, params))
+            if not ranked:
+                return queryset
+            # The leading NOT IN test spares unranked rows the per-id WHEN chain
+            return queryset.order_by(
+                Case(When(~Q(pk__in=ranked), then=len(ranked)),
+                     *[When(pk=pk, then=position) for position, pk in enumerate(ranked)],
+                     output_field=IntegerField()),
+                'name', 'id',
+            )
+
+    for term in terms:
+        queryset = queryset.filter(search_text__contains=term)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        return queryset.annotate(rank=TrigramSimilarity('search_text', ' '.join(terms))).order_by('-rank', 'name')
+    return queryset.order_by('name')
+
+
+def suggest_products(queryset, query, company_id):
+    """Best ``SUGGEST_LIMIT`` matches of ``company_id``'s products, for search-as-you-type"""
+    terms = normalize_arabic(query).split()
+    if not terms:
+        return queryset.none()
+    if connection.vendor == 'sqlite':
+        sql = 'SELECT rowid FROM app_product_fts WHERE app_product_fts MATCH %s AND company_id = %s'
+        params = [_fts_query(terms), company_id]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'{sql} LIMIT {SUGGEST_RANK_LIMIT + 1}', params)
+                ranked = [row[0] for row in cursor.fetchall()]
+                if len(ranked) <= SUGGEST_RANK_LIMIT:
+                    cursor.execute(f'{sql} ORDER BY rank LIMIT {SUGGEST_LIMIT}', params)
+                    ranked = [row[0] for row in cursor.fetchall()]
+                ranked = ranked[:SUGGEST_LIMIT]
+        except DatabaseError:
+            ranked = None
+        if ranked is not None:
+            return queryset.filter(pk__in=ranked).order_by(
+                Case(*[When(pk=pk, then=position) for position, pk in enumerate(ranked)], output_field=IntegerField())
+            )
+    return search_products(queryset, query, company_id)[:SUGGEST_LIMIT]
@@ -3,7 +3,7 @@ from rest_framework import serializers
 from .models import (
     Company, CompanyProfile, User, Category, Product, Customer,
     Invoice, InvoiceItem, Return, ReturnItem,
-    Payment, CustomerBalance
+    Payment, CustomerBalance, CustomerLedgerEntry
 )
 
 
@@ -20,7 +20,7 @@ class CompanyProfileSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'company', 'company_name', 'company_code', 'company_email', 'company_phone', 'company_address',
             'logo', 'logo_url', 'return_policy', 'payment_policy', 'language', 'navbar_message', 'dashboard_cards',
-            'primary_currency', 'secondary_currency', 'secondary_per_usd', 'price_display_mode',
+            'primary_currency', 'secondary_currency', 'secondary_per_usd', 'price_display_mode', 'draft_ttl_days',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
@@ -105,10 +105,36 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = [
-            'id', 'sku', 'name', 'price', 'stock_qty', 'category', 'category_name',
+            'id', 'sku', 'barcode', 'name', 'price', 'stock_qty', 'category', 'category_name',
             'unit', 'unit_display', 'measurement', 'description', 'archived',
-            'cost_price', 'wholesale_price', 'retail_price', 'created_at'
+            'cost_price', 'wholesale_price', 'retail_price', 'qr_code', 'created_at'
         ]
+        read_only_fields = ['qr_code']
+        # Mirrors the product_stock_qty_non_negative CHECK so clients get a 400, not an IntegrityError
+        extra_kwargs = {'stock_qty': {'min_value': 0}}
+
+    def validate_sku(self, value):
+        if not value:
+            return value
+        company_id = self.instance.company_id if self.instance else getattr(self.context['request'].user, 'company_id', None)
+        duplicates = Product.objects.filter(company_id=company_id, sku=value)
+        if self.instance:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError('sku_already_exists')
+        return value
+
+    def validate_barcode(self, value):
+        value = (value or '').strip()
+        if not value:
+            return None
+        company_id = self.instance.company_id if self.instance else getattr(self.context['request'].user, 'company_id', None)
+        duplicates = Product.objects.filter(company_id=company_id, barcode=value)
+        if self.instance:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError('barcode_already_exists')
+        return value
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -127,9 +153,10 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = InvoiceItem
         fields = [
-            'id', 'product', 'product_name', 'product_sku', 'qty', 'price_at_add',
+            'id', 'product', 'product_name', 'product_sku', 'qty', 'price_at_add', 'qty_returned_total',
             'line_total', 'unit_display', 'measurement', 'created_at'
         ]
+        read_only_fields = ['qty_returned_total']
 
     def get_unit_display(self, obj):
         try:
@@ -163,6 +190,17 @@ class InvoiceSerializer(serializers.ModelSerializer):
         read_only_fields = ['company', 'status', 'created_at', 'total_amount']
 
 
+class InvoiceListSerializer(serializers.ModelSerializer):
+    """Summary row for invoice lists; expects ``customer_name`` and ``items_count`` annotations"""
+    customer_name = serializers.CharField(read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Invoice
+        fields = ['id', 'company', 'customer', 'customer_name', 'status', 'created_at', 'total_amount', 'items_count']
+        read_only_fields = fields
+
+
 class ReturnItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_sku = serializers.CharField(source='product.sku', read_only=True)
@@ -227,3 +265,10 @@ class CustomerBalanceSerializer(serializers.ModelSerializer):
         read_only_fields = ['company', 'total_invoiced', 'total_paid', 'total_returns', 'balance', 'last_updated']
 
 
+class CustomerLedgerEntrySerializer(serializers.ModelSerializer):
+    entry_type_display = serializers.CharField(source='get_entry_type_display', read_only=True)
+
+    class Meta:
+        model = CustomerLedgerEntry
+        fields = ['id', 'entry_type', 'entry_type_display', 'source_id', 'reference', 'amount', 'balance', 'created_at']
+        read_only_fields = fields
@@ -0,0 +1,55 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, When
+
+from .models import Product
+
+
+class InsufficientStock(Exception):
+    """Raised when requested quantities exceed available stock"""
+
+    def __init__(self, products):
+        super().__init__('insufficient_stock')
+        self.products = products
+
+
+def lock_products(product_ids):
+    """Lock product rows in id order so concurrent sales cannot deadlock"""
+    return {p.id: p for p in Product.objects.select_for_update().filter(id__in=list(product_ids)).order_by('id')}
+
+
+def _apply_stock_deltas(deltas):
+    """Apply ``{product_id: signed int}`` stock deltas; the CHECK constraint rejects negative stock"""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Product.objects.filter(id__in=list(deltas)).update(stock_qty=Case(
+        *[When(id=product_id, then=F('stock_qty') + delta) for product_id, delta in deltas.items()],
+        output_field=IntegerField(),
+    ))
+
+
+def decrement_stock(quantities):
+    """Take ``{product_id: qty}`` out of stock, raising InsufficientStock for every short product"""
+    products = lock_products(quantities)
+    insufficient = [
+        {'product': product_id, 'product_name': products[product_id].name, 'required': float(qty), 'available': products[product_id].stock_qty}
+        for product_id, qty in quantities.items()
+        if products[product_id].stock_qty < qty
+    ]
+    if insufficient:
+        raise InsufficientStock(insufficient)
+    try:
+        with transaction.atomic():
+            _apply_stock_deltas({product_id: -int(qty) for product_id, qty in quantities.items()})
+    except IntegrityError:
+        # Only reachable if stock was changed outside the row locks
+        raise InsufficientStock([
+            {'product': product_id, 'product_name': products[product_id].name, 'required': float(qty), 'available': None}
+            for product_id, qty in quantities.items()
+        ])
+
+
+def increment_stock(quantities):
+    """Put ``{product_id: qty}`` back into stock"""
+    lock_products(quantities)
+    _apply_stock_deltas({product_id: int(qty) for product_id, qty in quantities.items()})
@@ -1,3 +1,696 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .balances import apply_balance_deltas, customer_totals
+from .carts import get_cart
+from .invoicing import confirm_invoice
+from .models import (
+    Category, Company, CompanyProfile, Customer, CustomerBalance, CustomerLedgerEntry, DocumentSequence,
+    IdempotencyKey, Invoice, InvoiceItem, Payment, Product, Return, User,
+)
+from .returns import ReturnExceedsSold, create_return, record_returned_quantities
+from .stock import InsufficientStock, decrement_stock
+
+# Keep draft carts out of the on-disk cache directory
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'carts': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-carts'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StocklyTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', code='ACME', phone='123')
+        cls.owner = User.objects.create_user(
+            username='owner', password='x', company=cls.company, account_type='company_owner'
+        )
+        cls.category = Category.objects.create(company=cls.company, name='General')
+        cls.customer = Customer.objects.create(company=cls.company, name='Ali')
+        cls.widget = Product.objects.create(company=cls.company, name='Widget', category=cls.category, price=Decimal('10'), stock_qty=100)
+        cls.gadget = Product.objects.create(company=cls.company, name='Gadget', category=cls.category, price=Decimal('5'), stock_qty=5)
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['carts'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def create_invoice(self, items):
+        response = self.client.post('/api/v1/invoices/', {'customer': self.customer.id}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        invoice_id = response.data['id']
+        response = self.client.post(f'/api/v1/invoices/{invoice_id}/add_items/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return Invoice.objects.get(pk=invoice_id)
+
+    def assertBalanceMatchesTotals(self):
+        balance = CustomerBalance.objects.get(customer=self.customer)
+        totals = customer_totals(self.customer, self.company)
+        self.assertEqual(
+            (balance.total_invoiced, balance.total_paid, balance.total_returns, balance.balance),
+            (totals['total_invoiced'], totals['total_paid'], totals['total_returns'], totals['balance']),
+        )
+        return balance
+
+
+class BalanceTests(StocklyTestCase):
+    def test_balance_follows_invoice_payment_and_return_lifecycle(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 3}])
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('30'))
+
+        response = self.client.post('/api/v1/payments/', {
+            'customer': self.customer.id, 'invoice': invoice.id, 'amount': '12', 'payment_method': 'cash',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        payment_id = response.data['id']
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('18'))
+
+        item = invoice.items.get()
+        response = self.client.post('/api/v1/returns/', {
+            'original_invoice': invoice.id, 'items': [{'original_item_id': item.id, 'qty_returned': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return_id = response.data['id']
+        response = self.client.post(f'/api/v1/returns/{return_id}/approve/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('8'))
+
+        self.assertEqual(self.client.delete(f'/api/v1/returns/{return_id}/').status_code, 204)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('18'))
+        self.assertEqual(self.client.delete(f'/api/v1/payments/{payment_id}/').status_code, 204)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('30'))
+
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/cancel/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('0'))
+
+    def test_deleting_confirmed_invoice_reverses_invoice_and_returns(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 4}])
+        self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        item = invoice.items.get()
+        response = self.client.post('/api/v1/returns/', {
+            'original_invoice': invoice.id, 'items': [{'original_item_id': item.id, 'qty_returned': 2}],
+        }, format='json')
+        self.client.post(f'/api/v1/returns/{response.data["id"]}/approve/')
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('20'))
+
+        self.assertEqual(self.client.delete(f'/api/v1/invoices/{invoice.id}/').status_code, 204)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('0'))
+
+    def test_apply_balance_deltas_seeds_missing_row_from_totals(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}])
+        with transaction.atomic():
+            confirm_invoice(invoice, post=False)
+            apply_balance_deltas(self.company, {self.customer.id: {'invoiced': invoice.total_amount}})
+        self.assertEqual(self.assertBalanceMatchesTotals().total_invoiced, Decimal('20'))
+
+        # An existing row is updated by the delta, not re-seeded
+        apply_balance_deltas(self.company, {self.customer.id: {'paid': Decimal('5')}})
+        balance = CustomerBalance.objects.get(customer=self.customer)
+        self.assertEqual((balance.total_paid, balance.balance), (Decimal('5'), Decimal('15')))
+
+
+class LedgerTests(StocklyTestCase):
+    def test_delete_adjustments_point_at_the_deleted_documents(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}])
+        self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        response = self.client.post('/api/v1/payments/', {
+            'customer': self.customer.id, 'amount': '5', 'payment_method': 'cash',
+        }, format='json')
+        payment_id = response.data['id']
+
+        self.assertEqual(self.client.delete(f'/api/v1/payments/{payment_id}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'/api/v1/invoices/{invoice.id}/').status_code, 204)
+        adjustments = CustomerLedgerEntry.objects.filter(entry_type=CustomerLedgerEntry.ADJUSTMENT).order_by('id')
+        self.assertEqual(
+            list(adjustments.values_list('source_id', 'reference', 'amount')),
+            [(payment_id, 'payment_deleted', Decimal('5')), (invoice.id, 'invoice_deleted', Decimal('-20'))],
+        )
+
+    def test_statement_lists_entries_with_running_balance(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 3}])
+        self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        self.client.post('/api/v1/payments/', {
+            'customer': self.customer.id, 'amount': '10', 'payment_method': 'cash',
+        }, format='json')
+
+        response = self.client.get(f'/api/v1/customers/{self.customer.id}/statement/')
+        self.assertEqual(response.status_code, 200, response.data)
+        rows = response.data['results']
+        self.assertEqual([Decimal(str(row['balance'])) for row in rows], [Decimal('30'), Decimal('20')])
+
+
+class StockTests(StocklyTestCase):
+    def test_confirm_takes_items_out_of_stock(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 3}, {'product': self.gadget.id, 'qty': 5}])
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        self.assertEqual(response.data, {'invoice_id': invoice.id, 'status': Invoice.CONFIRMED})
+        self.assertEqual(
+            dict(Product.objects.filter(pk__in=[self.widget.pk, self.gadget.pk]).values_list('pk', 'stock_qty')),
+            {self.widget.pk: 97, self.gadget.pk: 0},
+        )
+        self.assertEqual(self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/').status_code, 400)
+
+    def test_insufficient_stock_rolls_back_confirmation(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}, {'product': self.gadget.id, 'qty': 4}])
+        Product.objects.filter(pk=self.gadget.pk).update(stock_qty=3)
+
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['code'], 'insufficient_stock_for_confirmation')
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, Invoice.DRAFT)
+        self.assertEqual(
+            dict(Product.objects.filter(pk__in=[self.widget.pk, self.gadget.pk]).values_list('pk', 'stock_qty')),
+            {self.widget.pk: 100, self.gadget.pk: 3},
+        )
+        self.assertFalse(CustomerBalance.objects.filter(customer=self.customer).exists())
+
+    def test_decrement_stock_rejects_without_writing(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            with transaction.atomic():
+                decrement_stock({self.widget.id: 10, self.gadget.id: 6})
+        self.assertEqual([p['product'] for p in raised.exception.products], [self.gadget.id])
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 100)
+
+        with transaction.atomic():
+            decrement_stock({self.widget.id: 10, self.gadget.id: 5})
+        self.assertEqual(
+            dict(Product.objects.filter(pk__in=[self.widget.pk, self.gadget.pk]).values_list('pk', 'stock_qty')),
+            {self.widget.pk: 90, self.gadget.pk: 0},
+        )
+
+
+class InvoiceItemTests(StocklyTestCase):
+    def test_add_items_adds_lines_and_total(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}, {'product': self.gadget.id, 'qty': 1}])
+        self.assertEqual(invoice.total_amount, Decimal('25'))
+        self.assertEqual(invoice.items.count(), 2)
+
+    def test_add_items_rejects_unknown_product_and_short_stock(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 1}])
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/add_items/', {'items': [{'product': 999999, 'qty': 1}]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/add_items/', {'items': [{'product': self.gadget.id, 'qty': 6}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['code'], 'insufficient_stock')
+        self.assertEqual(invoice.items.count(), 1)
+
+    def test_repeated_product_is_merged_into_one_line(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}, {'product': self.widget.id, 'qty': 1}])
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/add_item/', {'product': self.widget.id, 'qty': 4}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(list(invoice.items.values_list('qty', flat=True)), [Decimal('7')])
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal('70'))
+
+
+class IdempotencyTests(StocklyTestCase):
+    def pay(self, key, amount='7'):
+        return self.client.post('/api/v1/payments/', {
+            'customer': self.customer.id, 'amount': amount, 'payment_method': 'cash',
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.pay('pay-1')
+        second = self.pay('pay-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((second.status_code, second.data), (201, first.data))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(CustomerBalance.objects.get(customer=self.customer).total_paid, Decimal('7'))
+
+    def test_key_reused_on_another_endpoint_is_rejected(self):
+        self.pay('shared')
+        response = self.client.post('/api/v1/invoices/', {'customer': self.customer.id}, format='json')
+        invoice_id = response.data['id']
+        response = self.client.post(
+            f'/api/v1/invoices/{invoice_id}/add_items/', {'items': [{'product': self.widget.id, 'qty': 1}]},
+            format='json', HTTP_IDEMPOTENCY_KEY='shared',
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(InvoiceItem.objects.filter(invoice_id=invoice_id).exists())
+
+    def test_failed_request_releases_the_key(self):
+        self.assertEqual(self.pay('retry', amount='oops').status_code, 400)
+        self.assertEqual(self.pay('retry').status_code, 201)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_request_still_in_progress_conflicts(self):
+        IdempotencyKey.objects.create(
+            user=self.owner, key='busy', method='POST', path='/api/v1/payments/',
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        response = self.pay('busy')
+        self.assertEqual((response.status_code, response.data['detail']), (409, 'request_in_progress'))
+        self.assertFalse(Payment.objects.exists())
+
+
+class CartTests(StocklyTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/v1/invoices/', {'customer': self.customer.id}, format='json')
+        self.invoice = Invoice.objects.get(pk=response.data['id'])
+        self.url = f'/api/v1/invoices/{self.invoice.id}/cart/'
+
+    def test_cart_lines_are_written_on_confirm(self):
+        self.client.post(self.url, {'items': [{'product': self.widget.id, 'qty': 2}]}, format='json')
+        response = self.client.post(self.url, {'items': [{'product': self.widget.id, 'qty': 1}]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['items'][0]['qty'], '3')
+        self.assertEqual(Decimal(response.data['total_amount']), Decimal('30'))
+        self.assertFalse(self.invoice.items.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/v1/invoices/{self.invoice.id}/confirm/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(list(self.invoice.items.values_list('product_id', 'qty')), [(self.widget.id, Decimal('3'))])
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 97)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('30'))
+        self.assertEqual(get_cart(self.invoice.id), {})
+
+    def test_put_replaces_and_delete_empties_the_cart(self):
+        self.client.post(self.url, {'items': [{'product': self.widget.id, 'qty': 2}]}, format='json')
+        response = self.client.put(self.url, {'items': [{'product': self.gadget.id, 'qty': 1}]}, format='json')
+        self.assertEqual([item['product'] for item in response.data['items']], [self.gadget.id])
+        response = self.client.delete(self.url)
+        self.assertEqual(response.data['items'], [])
+        self.assertEqual(self.client.post(self.url, {'items': [{'product': 999999, 'qty': 1}]}, format='json').status_code, 404)
+
+    def test_confirm_with_short_stock_keeps_the_cart(self):
+        self.client.post(self.url, {'items': [{'product': self.gadget.id, 'qty': 6}]}, format='json')
+        response = self.client.post(f'/api/v1/invoices/{self.invoice.id}/confirm/')
+        self.assertEqual(response.status_code, 400)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.DRAFT)
+        self.assertFalse(self.invoice.items.exists())
+        self.assertEqual(get_cart(self.invoice.id), {self.gadget.id: Decimal('6')})
+
+
+class CheckoutTests(StocklyTestCase):
+    def checkout(self, items, payment=None):
+        data = {'customer': self.customer.id, 'items': items}
+        if payment is not None:
+            data['payment'] = payment
+        return self.client.post('/api/v1/checkout/', data, format='json')
+
+    def test_checkout_confirms_and_posts_invoice_with_payment(self):
+        response = self.checkout([{'product': self.widget.id, 'qty': 2}], {'amount': '15', 'payment_method': 'cash'})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['status'], Invoice.CONFIRMED)
+        self.assertEqual(Decimal(response.data['balance']), Decimal('5'))
+        self.assertEqual(Payment.objects.get(pk=response.data['payment_id']).amount, Decimal('15'))
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 98)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('5'))
+
+    def test_checkout_with_short_stock_writes_nothing(self):
+        response = self.checkout([{'product': self.widget.id, 'qty': 1}, {'product': self.gadget.id, 'qty': 6}])
+        self.assertEqual((response.status_code, response.data['code']), (400, 'insufficient_stock'))
+        self.assertFalse(Invoice.objects.exists())
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 100)
+
+    def test_checkout_rejects_amounts_payment_cannot_store(self):
+        for amount in ('1e20', '0.00001', '-1', 'NaN', 'abc'):
+            with self.subTest(amount=amount):
+                response = self.checkout([{'product': self.widget.id, 'qty': 1}], {'amount': amount})
+                self.assertEqual((response.status_code, response.data['detail']), (400, 'invalid_payment_amount'))
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(CustomerBalance.objects.exists())
+
+
+class BulkConfirmTests(StocklyTestCase):
+    def test_drafts_are_confirmed_in_order_while_stock_lasts(self):
+        first = self.create_invoice([{'product': self.gadget.id, 'qty': 3}])
+        second = self.create_invoice([{'product': self.widget.id, 'qty': 1}, {'product': self.gadget.id, 'qty': 3}])
+        third = self.create_invoice([{'product': self.widget.id, 'qty': 1}])
+        self.client.post(f'/api/v1/invoices/{third.id}/confirm/')
+
+        response = self.client.post('/api/v1/invoices/bulk_confirm/', {
+            'ids': [first.id, second.id, third.id, 999999, first.id],
+        }, format='json', HTTP_IDEMPOTENCY_KEY='bulk-1')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['confirmed'], [first.id])
+        self.assertEqual(
+            [(row['invoice_id'], row['code']) for row in response.data['failed']],
+            [(second.id, 'insufficient_stock'), (third.id, 'not_draft'), (999999, 'not_found')],
+        )
+        shortage = response.data['failed'][0]['products']
+        self.assertEqual([(row['product'], row['available']) for row in shortage], [(self.gadget.id, 2)])
+        self.assertIs(type(shortage[0]['available']), int)
+
+        replay = self.client.post('/api/v1/invoices/bulk_confirm/', {
+            'ids': [first.id, second.id, third.id, 999999, first.id],
+        }, format='json', HTTP_IDEMPOTENCY_KEY='bulk-1')
+        self.assertEqual(replay.data['failed'][0]['products'][0]['available'], 2)
+
+        self.gadget.refresh_from_db()
+        self.assertEqual(self.gadget.stock_qty, 2)
+        self.assertEqual(
+            dict(Invoice.objects.values_list('pk', 'status')),
+            {first.id: Invoice.CONFIRMED, second.id: Invoice.DRAFT, third.id: Invoice.CONFIRMED},
+        )
+        self.assertEqual(self.assertBalanceMatchesTotals().total_invoiced, Decimal('25'))
+
+    def test_malformed_ids_are_rejected(self):
+        for ids in ([], 'x', [1, 'a']):
+            with self.subTest(ids=ids):
+                response = self.client.post('/api/v1/invoices/bulk_confirm/', {'ids': ids}, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+class CancelTests(StocklyTestCase):
+    def test_cancelling_confirmed_invoice_restores_stock_and_balance(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 4}, {'product': self.gadget.id, 'qty': 2}])
+        self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/cancel/')
+        self.assertEqual(response.data, {'invoice_id': invoice.id, 'status': Invoice.CANCELLED})
+        self.assertEqual(
+            dict(Product.objects.filter(pk__in=[self.widget.pk, self.gadget.pk]).values_list('pk', 'stock_qty')),
+            {self.widget.pk: 100, self.gadget.pk: 5},
+        )
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('0'))
+        self.assertEqual(self.client.post(f'/api/v1/invoices/{invoice.id}/cancel/').status_code, 400)
+
+    def test_cancelling_draft_drops_its_cart(self):
+        response = self.client.post('/api/v1/invoices/', {'customer': self.customer.id}, format='json')
+        invoice_id = response.data['id']
+        self.client.post(f'/api/v1/invoices/{invoice_id}/cart/', {'items': [{'product': self.widget.id, 'qty': 1}]}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/invoices/{invoice_id}/cancel/')
+        self.assertEqual(get_cart(invoice_id), {})
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 100)
+        self.assertFalse(CustomerBalance.objects.exists())
+
+    def test_invoice_with_returns_cannot_be_cancelled(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}])
+        self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        self.client.post('/api/v1/returns/', {
+            'original_invoice': invoice.id, 'items': [{'original_item_id': invoice.items.get().id, 'qty_returned': 1}],
+        }, format='json')
+        response = self.client.post(f'/api/v1/invoices/{invoice.id}/cancel/')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'invoice_has_returns'))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, Invoice.CONFIRMED)
+
+
+class DraftExpiryTests(StocklyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stale = self.create_invoice([{'product': self.widget.id, 'qty': 1}])
+        self.recent = self.create_invoice([{'product': self.widget.id, 'qty': 1}])
+        self.confirmed = self.create_invoice([{'product': self.widget.id, 'qty': 1}])
+        self.client.post(f'/api/v1/invoices/{self.confirmed.id}/confirm/')
+        Invoice.objects.filter(pk__in=[self.stale.pk, self.confirmed.pk]).update(
+            created_at=timezone.now() - timedelta(days=31)
+        )
+
+    def test_stale_drafts_are_deleted(self):
+        out = StringIO()
+        call_command('expire_drafts', '--batch-size', '1', stdout=out)
+        self.assertIn('Stale drafts deleted: 1', out.getvalue())
+        self.assertEqual(set(Invoice.objects.values_list('pk', flat=True)), {self.recent.pk, self.confirmed.pk})
+
+    def test_cancel_and_per_company_ttl(self):
+        CompanyProfile.objects.create(company=self.company, draft_ttl_days=0)
+        call_command('expire_drafts', stdout=StringIO())
+        self.assertEqual(Invoice.objects.count(), 3)
+
+        CompanyProfile.objects.filter(company=self.company).update(draft_ttl_days=30)
+        call_command('expire_drafts', '--cancel', stdout=StringIO())
+        self.assertEqual(
+            dict(Invoice.objects.values_list('pk', 'status')),
+            {self.stale.pk: Invoice.CANCELLED, self.recent.pk: Invoice.DRAFT, self.confirmed.pk: Invoice.CONFIRMED},
+        )
+
+
+class ReturnTests(StocklyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}, {'product': self.gadget.id, 'qty': 3}])
+        self.client.post(f'/api/v1/invoices/{self.invoice.id}/confirm/')
+        self.item = self.invoice.items.get(product=self.widget)
+
+    def create(self, items):
+        return self.client.post('/api/v1/returns/', {'original_invoice': self.invoice.id, 'items': items}, format='json')
+
+    def test_return_is_created_pending_with_its_total(self):
+        gadget_item = self.invoice.items.get(product=self.gadget)
+        response = self.create([
+            {'original_item_id': self.item.id, 'qty_returned': 1},
+            {'original_item_id': gadget_item.id, 'qty_returned': 2},
+            {'original_item_id': self.item.id, 'qty_returned': 1},
+        ])
+        self.assertEqual(response.status_code, 201, response.data)
+        return_obj = Return.objects.get(pk=response.data['id'])
+        self.assertEqual((return_obj.status, return_obj.total_amount), ('pending', Decimal('30')))
+        self.assertEqual(
+            dict(return_obj.items.values_list('original_item_id', 'qty_returned')),
+            {self.item.id: Decimal('2'), gadget_item.id: Decimal('2')},
+        )
+
+    def test_invalid_lines_write_nothing(self):
+        other = self.create_invoice([{'product': self.widget.id, 'qty': 1}]).items.get()
+        self.assertEqual(self.create([{'original_item_id': other.id, 'qty_returned': 1}]).status_code, 404)
+        response = self.create([{'original_item_id': self.item.id, 'qty_returned': 3}])
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'qty_returned_exceeds_sold'))
+        self.assertEqual(self.create([{'original_item_id': self.item.id, 'qty_returned': 0}]).status_code, 400)
+        self.assertFalse(Return.objects.exists())
+
+    def test_create_return_rejects_more_than_sold(self):
+        with self.assertRaises(ReturnExceedsSold):
+            with transaction.atomic():
+                create_return(self.invoice, {self.item.id: Decimal('3')}, self.owner)
+
+    def test_returned_quantity_follows_approval_and_delete(self):
+        return_id = self.create([{'original_item_id': self.item.id, 'qty_returned': 1}]).data['id']
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_returned_total, 0)
+
+        self.client.post(f'/api/v1/returns/{return_id}/approve/')
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_returned_total, 1)
+        response = self.create([{'original_item_id': self.item.id, 'qty_returned': 2}])
+        self.assertEqual((response.status_code, response.data['already_returned']), (400, 1.0))
+
+        self.client.delete(f'/api/v1/returns/{return_id}/')
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_returned_total, 0)
+
+    def test_approval_restocks_and_credits_the_customer(self):
+        return_id = self.create([{'original_item_id': self.item.id, 'qty_returned': 2}]).data['id']
+        self.assertEqual(self.client.post(f'/api/v1/returns/{return_id}/approve/').status_code, 200)
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 100)
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('15'))
+        self.assertEqual(self.client.post(f'/api/v1/returns/{return_id}/approve/').status_code, 400)
+
+    def test_overlapping_pending_returns_cannot_both_be_approved(self):
+        return_ids = [self.create([{'original_item_id': self.item.id, 'qty_returned': 2}]).data['id'] for _ in range(2)]
+        self.assertEqual(self.client.post(f'/api/v1/returns/{return_ids[0]}/approve/').status_code, 200)
+        response = self.client.post(f'/api/v1/returns/{return_ids[1]}/approve/')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'qty_returned_exceeds_sold'))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_returned_total, self.item.qty)
+        self.widget.refresh_from_db()
+        self.assertEqual(self.widget.stock_qty, 100)
+
+    def test_bulk_approve_skips_returns_past_the_sold_quantity(self):
+        gadget_item = self.invoice.items.get(product=self.gadget)
+        first = self.create([{'original_item_id': self.item.id, 'qty_returned': 2}]).data['id']
+        second = self.create([{'original_item_id': self.item.id, 'qty_returned': 1}]).data['id']
+        third = self.create([{'original_item_id': gadget_item.id, 'qty_returned': 3}]).data['id']
+
+        response = self.client.post('/api/v1/returns/bulk_approve/', {'ids': [first, second, third, 999999]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['approved'], [first, third])
+        self.assertEqual(
+            [(row['return_id'], row['code']) for row in response.data['failed']],
+            [(second, 'qty_returned_exceeds_sold'), (999999, 'not_found')],
+        )
+        self.assertEqual(
+            dict(Product.objects.filter(pk__in=[self.widget.pk, self.gadget.pk]).values_list('pk', 'stock_qty')),
+            {self.widget.pk: 100, self.gadget.pk: 5},
+        )
+        self.assertEqual(self.assertBalanceMatchesTotals().balance, Decimal('0'))
+
+    def test_record_returned_quantities_enforces_sold_quantity(self):
+        with self.assertRaises(ReturnExceedsSold):
+            with transaction.atomic():
+                record_returned_quantities({self.item.id: Decimal('3')})
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_returned_total, 0)
+
+
+class DocumentSequenceTests(StocklyTestCase):
+    def test_allocate_reserves_consecutive_blocks(self):
+        other = Company.objects.create(name='Other', code='OTHER', phone='456')
+        self.assertEqual(DocumentSequence.allocate(other.id, 'test', count=3), 1)
+        self.assertEqual(DocumentSequence.allocate(other.id, 'test'), 4)
+        self.assertEqual(DocumentSequence.allocate(self.company.id, 'test'), 1)
+
+    def test_return_numbers_follow_the_company_sequence(self):
+        invoice = self.create_invoice([{'product': self.widget.id, 'qty': 2}])
+        self.client.post(f'/api/v1/invoices/{invoice.id}/confirm/')
+        item = invoice.items.get()
+        numbers = [
+            self.client.post('/api/v1/returns/', {
+                'original_invoice': invoice.id, 'items': [{'original_item_id': item.id, 'qty_returned': 1}],
+            }, format='json').data['return_number']
+            for _ in range(2)
+        ]
+        self.assertEqual(numbers, ['RET-ACME-0001', 'RET-ACME-0002'])
+
+
+class SearchTests(StocklyTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.school = Product.objects.create(company=cls.company, category=cls.category, name='حقيبة مدرسة النور', price=Decimal('40'))
+        cls.pencil = Product.objects.create(company=cls.company, category=cls.category, name='قلم رصاص', description='مدرسة', price=Decimal('2'))
+        other = Company.objects.create(name='Other', code='OTHER', phone='456')
+        Product.objects.create(
+            company=other, category=Category.objects.create(company=other, name='General'), name='حقيبة مدرسه', price=Decimal('1')
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/v1/products/', {'search': query})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['id'] for row in response.data.get('results', response.data)]
+
+    def test_search_folds_arabic_spelling_variants(self):
+        self.assertEqual(self.search('حقيبه مدرسه نور'), [self.school.id])
+        self.assertEqual(self.search('أحقيبة'), [])
+        self.assertEqual(self.search('widget'), [self.widget.id])
+
+    def test_search_matches_stay_within_the_company(self):
+        self.assertEqual(set(self.search('مدرسة')), {self.school.id, self.pencil.id})
+
+    def test_suggest_returns_the_scanner_fields(self):
+        response = self.client.get('/api/v1/products/suggest/', {'q': 'حقيبه'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['id'], row['price']) for row in response.data], [(self.school.id, '40.0000')])
+        self.assertEqual(self.client.get('/api/v1/products/suggest/', {'q': ''}).data, [])
+
+
+class LookupTests(StocklyTestCase):
+    def lookup(self, code):
+        return self.client.get('/api/v1/products/lookup/', {'code': code})
+
+    def test_lookup_by_sku_then_barcode(self):
+        Product.objects.filter(pk=self.gadget.pk).update(barcode='6221234567890')
+        self.widget.refresh_from_db()
+        response = self.lookup(self.widget.sku)
+        self.assertEqual((response.status_code, response.data['id'], response.data['stock_qty']), (200, self.widget.id, 100))
+        self.assertEqual(self.lookup('6221234567890').data['id'], self.gadget.id)
+        self.assertEqual(self.lookup('missing').status_code, 404)
+        self.assertEqual(self.lookup('').status_code, 400)
+
+    def test_cached_lookup_sees_product_saves_and_stock_moves(self):
+        self.widget.refresh_from_db()
+        self.assertEqual(self.lookup(self.widget.sku).data['name'], 'Widget')
+
+        self.widget.name = 'Widget Pro'
+        self.widget.save()
+        Product.objects.filter(pk=self.widget.pk).update(stock_qty=7)
+        response = self.lookup(self.widget.sku)
+        self.assertEqual((response.data['name'], response.data['stock_qty']), ('Widget Pro', 7))
+
+        self.widget.delete()
+        self.assertEqual(self.lookup(self.widget.sku).status_code, 404)
+
+
+class ImportTests(StocklyTestCase):
+    def upload(self, content, name='products.csv', **data):
+        return self.client.post(
+            '/api/v1/products/import/', {'file': SimpleUploadedFile(name, content), **data}, format='multipart'
+        )
+
+    def test_bad_rows_are_reported_and_the_rest_imported(self):
+        self.widget.refresh_from_db()
+        content = (
+            'name,price,category,sku,stock_qty\n'
+            'Bolt,1.5,General,B-1,10\n'
+            'Nut,abc,General,,\n'
+            f'Copy,2,General,{self.widget.sku},\n'
+            'Screw,3,Missing,,\n'
+            'Washer,0.25,General,B-1,\n'
+        ).encode()
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 4))
+        self.assertEqual(response.data['errors'], [
+            {'row': 3, 'errors': {'price': 'invalid_number'}},
+            {'row': 4, 'errors': {'sku': 'sku_already_exists'}},
+            {'row': 5, 'errors': {'category': 'category_not_found'}},
+            {'row': 6, 'errors': {'sku': 'sku_already_exists'}},
+        ])
+        bolt = Product.objects.get(company=self.company, sku='B-1')
+        self.assertEqual((bolt.name, bolt.price, bolt.stock_qty, bolt.category_id), ('Bolt', Decimal('1.5'), 10, self.category.id))
+
+    def test_dry_run_and_arabic_headers_in_cp1256(self):
+        content = 'الاسم,السعر,الفئة\nقلم,2,General\n'.encode('cp1256')
+        response = self.upload(content, dry_run='true')
+        self.assertEqual((response.status_code, response.data['created'], response.data['failed']), (200, 1, 0))
+        self.assertFalse(Product.objects.filter(name='قلم').exists())
+
+    def test_unreadable_files_are_rejected(self):
+        response = self.upload(b'name,sku\nBolt,B-1\n')
+        self.assertEqual((response.status_code, response.data['detail'], response.data['columns']), (400, 'missing_columns', ['price', 'category']))
+        response = self.upload(b'not a workbook', name='products.xlsx')
+        self.assertIn(response.data['detail'], ('invalid_xlsx', 'xlsx_not_supported'))
+        self.assertEqual(self.upload(b'').data['detail'], 'empty_file')
+        self.assertEqual(Product.objects.count(), 2)
+
+
+class ExportTests(StocklyTestCase):
+    def export(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_product_export_applies_search_and_filters(self):
+        lines = self.export('/api/v1/products/export/', search='widget').splitlines()
+        self.assertTrue(lines[0].startswith('\ufeffid,sku,barcode,name,category_name,price'))
+        self.assertEqual([line.split(',')[3] for line in lines[1:]], ['Widget'])
+        Product.objects.filter(pk=self.gadget.pk).update(archived=True)
+        lines = self.export('/api/v1/products/export/', archived='true').splitlines()
+        self.assertEqual([line.split(',')[3] for line in lines[1:]], ['Gadget'])
+
+    def test_ndjson_export_and_format_check(self):
+        for amount in ('5', '7.5'):
+            self.client.post('/api/v1/payments/', {
+                'customer': self.customer.id, 'amount': amount, 'payment_method': 'cash',
+            }, format='json')
+        rows = [json.loads(line) for line in self.export('/api/v1/payments/export/', export_format='ndjson').splitlines()]
+        self.assertEqual([(row['customer_name'], Decimal(row['amount'])) for row in rows], [('Ali', Decimal('5')), ('Ali', Decimal('7.5'))])
+        response = self.client.get('/api/v1/customers/export/', {'export_format': 'xml'})
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'invalid_export_format'))
+
+
+class LabelTests(StocklyTestCase):
+    def test_label_sheet_is_a_pdf_of_the_given_products(self):
+        response = self.client.post('/api/v1/products/labels/', {'ids': [self.widget.id, self.gadget.id, self.widget.id]}, format='json')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/pdf'))
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        response = self.client.post('/api/v1/products/labels/', {'ids': ['x']}, format='json')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'invalid product id'))
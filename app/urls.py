@@ -6,7 +6,7 @@ from .api_v1 import (
     InvoiceViewSet, ReturnViewSet, PaymentViewSet,
     CustomerBalanceViewSet, CompanyProfileViewSet, UsersViewSet,
     OTPRequestView, OTPVerifyView, ResetPasswordView,
-    DashboardStatsView, CompanyRegisterView, WhatsAppWebhookView, LegacyDeleteUserView
+    DashboardStatsView, CheckoutView, CompanyRegisterView, WhatsAppWebhookView, LegacyDeleteUserView
 )
 # Note: This app exposes API endpoints only. No server-rendered templates.
 
@@ -31,6 +31,9 @@ urlpatterns = [
   # Dashboard stats (moved to APIView)
   path('api/dashboard/stats', DashboardStatsView.as_view()),
 
+  # Counter sale: invoice + items + confirm + payment in one call
+  path('api/v1/checkout/', CheckoutView.as_view()),
+
   # Auth/OTP (v1 public)
   path('api/v1/auth/otp/send/', OTPRequestView.as_view()),
   path('api/v1/auth/otp/verify/', OTPVerifyView.as_view()),
@@ -46,6 +46,7 @@ interface ApiInvoice {
   status: InvoiceStatus;
   created_at: string;
   items?: any[];
+  items_count?: number;
 }
 
 interface OptionItem { id: number; name: string }
@@ -230,34 +231,14 @@ export const Invoices: React.FC = () => {
     },
   });
 
-  // Returns summary for selected invoice
-  const { data: returnsListData, isFetching: returnsFetching } = useQuery({
-    queryKey: ['returns-by-invoice', returnInvoice?.id, returnInvoice?.customer],
-    queryFn: async () => {
-      const params: any = {};
-      if (returnInvoice?.customer) params.customer = returnInvoice.customer;
-      const res = await apiClient.get(endpoints.returns, { params });
-      return normalizeListResponse<any>(res.data);
-    },
-    enabled: Boolean(returnDialogOpen && returnInvoice?.id),
-  });
-
-  const returnedByItemId = useMemo(() => {
-    const map = new Map<number, number>();
-    const results = returnsListData?.results || [];
-    results.forEach((ret: any) => {
-      if (ret.invoice_id !== (returnInvoice?.id || ret.original_invoice)) return;
-      if (ret.status === 'rejected') return;
-      (ret.items || []).forEach((rit: any) => {
-        const key = Number(rit.original_item);
-        const qty = Number(rit.qty_returned || 0);
-        map.set(key, (map.get(key) || 0) + qty);
-      });
-    });
-    return map;
-  }, [returnsListData, returnInvoice]);
+  // The list endpoint returns summaries only; load the full invoice with its items
+  const fetchInvoiceDetails = async (id: number) => {
+    const res = await apiClient.get(endpoints.invoiceDetails(id));
+    return res.data as ApiInvoice;
+  };
 
-  const openReturnDialog = (inv: ApiInvoice) => {
+  const openReturnDialog = async (summary: ApiInvoice) => {
+    const inv = await fetchInvoiceDetails(summary.id);
     setReturnInvoice(inv);
     // init inputs to empty
     const initial: Record<number, string> = {};
@@ -302,8 +283,8 @@ export const Invoices: React.FC = () => {
     },
   });
 
-  const openPreview = (invoice: ApiInvoice) => {
-    setPreviewInvoice(invoice);
+  const openPreview = async (summary: ApiInvoice) => {
+    setPreviewInvoice(await fetchInvoiceDetails(summary.id));
     setPreviewOpen(true);
   };
 
@@ -490,7 +471,7 @@ export const Invoices: React.FC = () => {
                   const statusConfig = statusConfigMap[invoice.status];
                   const StatusIcon = statusConfig.icon;
 
-                  const itemsCount = invoice.items?.length ?? 0;
+                  const itemsCount = invoice.items_count ?? invoice.items?.length ?? 0;
                   const amount = Number(invoice.total_amount || 0);
 
                   const isDraft = invoice.status === 'draft';
@@ -816,7 +797,8 @@ export const Invoices: React.FC = () => {
                   <tbody>
                     {(returnInvoice.items || []).map((it: any) => {
                       const sold = Number(it.qty || 0);
-                      const alreadyReturned = Number(returnedByItemId.get(it.id) || 0);
+                      // Approved returns are tracked on the line itself
+                      const alreadyReturned = Number(it.qty_returned_total || 0);
                       const remaining = Math.max(0, sold - alreadyReturned);
                       return (
                         <tr key={it.id} className="border-b border-border last:border-b-0">
@@ -28,6 +28,7 @@ interface ApiProduct {
   id: number;
   name: string;
   sku: string;
+  barcode?: string | null;
   category?: number;
   category_name?: string | null;
   price: number | string;
@@ -53,6 +54,7 @@ export const Products: React.FC = () => {
   const [productForm, setProductForm] = useState({
     name: '',
     sku: '',
+    barcode: '',
     category: '',
     price: '',
     stock_qty: '',
@@ -112,6 +114,7 @@ export const Products: React.FC = () => {
     setProductForm({
       name: '',
       sku: '',
+      barcode: '',
       category: '',
       price: '',
       stock_qty: '',
@@ -337,6 +340,7 @@ export const Products: React.FC = () => {
                               setProductForm({
                                 name: product.name || '',
                                 sku: product.sku || '',
+                                barcode: product.barcode || '',
                                 category: product.category ? String(product.category) : '',
                                 price: String(typeof product.price === 'number' ? product.price : (product.price || '')),
                                 stock_qty: String(product.stock_qty ?? ''),
@@ -485,6 +489,12 @@ export const Products: React.FC = () => {
                   value={productForm.sku}
                   onChange={handleProductFieldChange('sku')}
                 />
+                <Input
+                  label="الباركود"
+                  placeholder="اختياري"
+                  value={productForm.barcode}
+                  onChange={handleProductFieldChange('barcode')}
+                />
                 <Input
                   label="القياس"
                   placeholder="مثال: 1 لتر"
@@ -557,6 +567,9 @@ export const Products: React.FC = () => {
                 const sku = productForm.sku.trim();
                 if (sku) payload.sku = sku;
 
+                const barcode = productForm.barcode.trim();
+                if (barcode) payload.barcode = barcode;
+
                 const measurement = productForm.measurement.trim();
                 if (measurement) payload.measurement = measurement;
 
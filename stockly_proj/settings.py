@@ -94,6 +94,29 @@ DATABASES = {
 }
 
 
+# Cache
+# Draft invoice carts live in their own cache so they survive across workers;
+# switch 'carts' to Redis/Memcached in larger deployments.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'carts',
+        'TIMEOUT': 60 * 60 * 24 * 7,
+    },
+}
+CART_CACHE_ALIAS = 'carts'
+# Scanner lookups (/products/lookup/) are cached in this cache. Product writes
+# invalidate it only in the process that handled them, so with the per-process
+# 'default' cache other workers may serve a renamed/repriced/archived product
+# for up to PRODUCT_LOOKUP_CACHE_TIMEOUT seconds; point the alias at a shared
+# cache (Redis/Memcached) to make invalidation immediate everywhere.
+PRODUCT_LOOKUP_CACHE_ALIAS = 'default'
+PRODUCT_LOOKUP_CACHE_TIMEOUT = 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -204,6 +227,8 @@ CORS_ALLOWED_ORIGINS = [
     'http://148.230.116.71:8080',
 ]
 CORS_ALLOW_CREDENTIALS = False
+from corsheaders.defaults import default_headers
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 # Additional CSRF settings
 CSRF_COOKIE_SECURE = True  # Set to True in production with HTTPS
@@ -219,6 +244,9 @@ SESSION_COOKIE_SAMESITE = 'Lax'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# TTF font for product label sheets; Arabic names need one (e.g. Noto Naskh Arabic), Helvetica otherwise
+LABEL_FONT_PATH = None
+
 # Production settings
 if not DEBUG:
     SECURE_SSL_REDIRECT = True
@@ -242,3 +270,6 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': False,
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
+
+# Idempotency-Key replay window for invoice, payment and return mutations
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)